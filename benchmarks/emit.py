@@ -0,0 +1,98 @@
+"""
+Measure the cost of `EventEmitter.emit` with 0, 1 and many listeners, with
+many pattern subscriptions and the memory used by emitting events that nobody
+listens to.
+
+Usage: python benchmarks/emit.py [count]
+"""
+
+import gc
+import sys
+import time
+
+from biloba import events
+
+
+def noop(*args):
+    pass
+
+
+def measure(listener_count, count, pattern_count=0, event='foo'):
+    emitter = events.EventEmitter()
+
+    for _ in xrange(listener_count):
+        emitter.on(event, noop)
+
+    # one pattern that matches and many that do not
+    if pattern_count:
+        emitter.on('conn.**', noop)
+
+    for i in xrange(pattern_count - 1):
+        emitter.on('other{}.*.timeout'.format(i), noop)
+
+    emit = emitter.emit
+
+    gc.collect()
+    gc.disable()
+
+    try:
+        before = gc.get_count()[0]
+        start = time.time()
+
+        for _ in xrange(count):
+            emit(event, 1, 2)
+
+        elapsed = time.time() - start
+        allocated = gc.get_count()[0] - before
+    finally:
+        gc.enable()
+
+    return allocated, elapsed
+
+
+def measure_absent(count):
+    """
+    Emit ``count`` different events that nobody listens to.
+    """
+    emitter = events.EventEmitter()
+
+    for i in xrange(count):
+        emitter.emit(i)
+
+    return len(emitter._events)
+
+
+def main(count):
+    print '{:>10} {:>14} {:>14}'.format('listeners', 'objects/emit', 'us/emit')
+
+    for listener_count in (0, 1, 10, 100):
+        allocated, elapsed = measure(listener_count, count)
+
+        print '{:>10} {:>14.2f} {:>14.3f}'.format(
+            listener_count,
+            float(allocated) / count,
+            elapsed * 1e6 / count,
+        )
+
+    print
+    print '{:>10} {:>14} {:>14}'.format('patterns', 'objects/emit', 'us/emit')
+
+    for pattern_count in (1, 10, 100, 1000):
+        allocated, elapsed = measure(
+            1, count, pattern_count, 'conn.close.timeout'
+        )
+
+        print '{:>10} {:>14.2f} {:>14.3f}'.format(
+            pattern_count,
+            float(allocated) / count,
+            elapsed * 1e6 / count,
+        )
+
+    print
+    print 'events stored after emitting {} absent events: {}'.format(
+        count, measure_absent(count)
+    )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
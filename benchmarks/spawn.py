@@ -0,0 +1,78 @@
+"""
+Compare the cost of `Service.spawn` with spawning a greenlet that wraps the
+function in a closure and the `emit_exceptions` context manager (how
+`Service.spawn` used to work).
+
+Usage: python benchmarks/spawn.py [count]
+"""
+
+import functools
+import gc
+import sys
+import time
+
+import gevent
+
+from biloba import service
+
+
+def noop():
+    pass
+
+
+def closure_spawn(my_service, func, *args, **kwargs):
+    @functools.wraps(func)
+    def wrapped():
+        with my_service.emit_exceptions(propagate=False):
+            return func(*args, **kwargs)
+
+    return my_service.pool.spawn(wrapped)
+
+
+def service_spawn(my_service, func, *args, **kwargs):
+    return my_service.spawn(func, *args, **kwargs)
+
+
+def measure(spawn, count):
+    my_service = service.Service()
+
+    gc.collect()
+    gc.disable()
+
+    try:
+        # the number of gc tracked objects allocated by spawning
+        before = gc.get_count()[0]
+        start = time.time()
+
+        threads = [spawn(my_service, noop) for _ in xrange(count)]
+
+        spawned = time.time() - start
+        allocated = gc.get_count()[0] - before
+
+        gevent.joinall(threads)
+
+        total = time.time() - start
+    finally:
+        gc.enable()
+
+    return allocated, spawned, total
+
+
+def main(count):
+    print '{:>10} {:>14} {:>14} {:>14}'.format(
+        '', 'objects/spawn', 'us/spawn', 'us/greenlet'
+    )
+
+    for name, spawn in [('closure', closure_spawn), ('spawn', service_spawn)]:
+        allocated, spawned, total = measure(spawn, count)
+
+        print '{:>10} {:>14.2f} {:>14.2f} {:>14.2f}'.format(
+            name,
+            float(allocated) / count,
+            spawned * 1e6 / count,
+            total * 1e6 / count,
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
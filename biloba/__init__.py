@@ -1,4 +1,7 @@
 from .service import Service, ConfigurableService
+from .prefork import ProcessSupervisorService
+from .workers import WorkerPoolService
+from .logs import AsyncLogService
 from .config import parse_address
 from .util import waitany, cachedproperty
 
@@ -10,8 +13,11 @@ __version_info__ = _pkg_meta.version_info
 
 
 __all__ = [
+    'AsyncLogService',
     'ConfigurableService',
+    'ProcessSupervisorService',
     'Service',
+    'WorkerPoolService',
     'parse_address',
     'waitany',
     'cachedproperty',
@@ -34,13 +34,32 @@ import collections
 import contextlib
 import functools
 import sys
+import time
+import types
+import weakref
+
+import gevent
+from gevent import queue
 
 
 __all__ = [
+    'AsyncDispatcher',
+    'ErrorCoalescer',
     'EventEmitter',
+    'PatternIndex',
+    'Subscription',
+    'WeakListener',
 ]
 
 
+#: drop events when the `emit_async` queue is full
+DROP = 'drop'
+#: block the emitting greenlet until there is space in the queue
+BLOCK = 'block'
+
+POLICIES = (DROP, BLOCK)
+
+
 class EventEmitter(object):
     """
     The EventEmitter class.
@@ -61,19 +80,63 @@ class EventEmitter(object):
             logging.error('something bad happened', exc_info=exc_info)
 
         ee.emit('error', Exception('something blew up'))
+
+    Patterns
+    --------
+
+    Event names are namespaced by '.'. Listeners can be registered to a
+    pattern where a segment is ``*`` (any one segment) or ``**`` (any number
+    of segments, including none), e.g. ``conn.*`` is called for
+    ``conn.open`` and ``conn.**`` for ``conn.close.timeout`` too. The patterns
+    that match an event are looked up in a `PatternIndex`. Listeners of the
+    event itself are called before the listeners of matching patterns. Only
+    names with a segment that is exactly ``*`` or ``**`` are patterns, so
+    ``price*`` is a plain event name.
+
+    Asynchronous emits
+    ------------------
+
+    `emit_async` queues the event and returns immediately, the listeners are
+    called from a dispatcher greenlet (see `AsyncDispatcher`) so slow
+    listeners do not delay the emitting code. The queue holds at most
+    ``emit_buffer_size`` events, ``emit_overflow`` is what happens when it is
+    full.
     """
 
     __slots__ = (
         '_events',
+        '_cancelled',
+        '_patterns',
+        '_index',
+        '_dispatcher',
+        '__weakref__',
     )
 
+    # the maximum number of events queued by `emit_async`, `None` means
+    # unbounded.
+    emit_buffer_size = 1000
+    # what `emit_async` does when the queue is full, one of 'drop' or 'block'.
+    emit_overflow = DROP
+
     def __init__(self):
         """
         Initializes the emitter.
         """
-        self._events = collections.defaultdict(list)
-
-    def on(self, event, f=None):
+        # event -> list of `Subscription`. Cancelled subscriptions are only
+        # flagged and the list is compacted (replaced, never mutated in place)
+        # once at least half of it is cancelled. Events that nobody listens to
+        # do not have an entry.
+        self._events = {}
+        # event -> the number of cancelled subscriptions in its list
+        self._cancelled = {}
+        # pattern -> list of `Subscription`, like `_events`
+        self._patterns = {}
+        # created when the first pattern is subscribed to
+        self._index = None
+        # created by the first `emit_async`
+        self._dispatcher = None
+
+    def on(self, event, f=None, weak=False):
         """Registers the function ``f`` to the event name ``event``.
 
         If ``f`` isn't provided, this method returns a function that
@@ -84,10 +147,12 @@ class EventEmitter(object):
             def data_handler(data):
                 print data
 
+        If ``weak`` is `True`, the emitter only holds a weak reference to the
+        listener (see `WeakListener`) and removes it once it is garbage
+        collected.
         """
         def _on(f):
-            # Add the necessary function
-            self.listeners(event).append(f)
+            self.subscribe(event, f, weak=weak)
 
             # Return original function so removal works
             return f
@@ -97,6 +162,37 @@ class EventEmitter(object):
         else:
             return _on(f)
 
+    def subscribe(self, event, f, once=False, weak=False):
+        """
+        Registers the function ``f`` to the event name ``event``, like `on`.
+
+        :param once: Whether the listener is removed before it is first called.
+        :param weak: Whether the emitter only holds a weak reference to ``f``.
+        :returns: A `Subscription` that removes the listener in constant time.
+        """
+        subscription = Subscription(self, event, f, once)
+
+        if weak:
+            subscription.func = WeakListener(
+                f, lambda ref: subscription.cancel()
+            )
+
+        events = self._get_events(event)
+        subscriptions = events.get(event)
+
+        if subscriptions is None:
+            if events is self._patterns:
+                if self._index is None:
+                    self._index = PatternIndex()
+
+                self._index.add(event)
+
+            subscriptions = events[event] = []
+
+        subscriptions.append(subscription)
+
+        return subscription
+
     def emit(self, event, *args, **kwargs):
         """
         Emit ``event``, passing ``*args`` to each attached function. Returns
@@ -123,41 +219,107 @@ class EventEmitter(object):
         tuple, even if an exception instance is supplied.
 
         If the ``error`` event is not handled, the exception is raised inline.
+
+        Listeners removed while the event is being emitted are not called,
+        listeners added while the event is being emitted are not called until
+        the next time it is emitted.
         """
-        listeners = self.listeners(event)
+        # compaction keeps at least one active subscription in every list
+        subscriptions = self._events.get(event)
+        matched = None
+
+        if self._index is not None and isinstance(event, basestring):
+            patterns = self._index.match(event)
+
+            if patterns:
+                matched = [self._patterns[pattern] for pattern in patterns]
 
         if event == 'error':
             # convert args in to a tuple as returned by sys.exc_info
             args = get_exc_info(*args)
 
-            if not listeners:
+            if not subscriptions and not matched:
                 raise args[0], args[1], args[2]
 
-        # Pass the args to each function in the events dict
-        for func in listeners:
-            func(*args, **kwargs)
+        if subscriptions:
+            call_subscriptions(subscriptions, args, kwargs)
+        elif not matched:
+            return False
+
+        if matched:
+            for subscriptions in matched:
+                call_subscriptions(subscriptions, args, kwargs)
 
         # whether the event was handled.
-        return bool(listeners)
+        return True
+
+    def emit_async(self, event, *args, **kwargs):
+        """
+        Queue ``event`` to be emitted (see `emit`) by a dispatcher greenlet
+        instead of calling the listeners in the current greenlet.
+
+        Events queued by an emitter are emitted in the order they were
+        queued. Events emitted synchronously are not ordered with respect to
+        queued events. Exceptions raised by the listeners are passed to
+        `handle_dispatch_error`.
+
+        :returns: Whether the event was queued, `False` if it was dropped
+            because the queue was full.
+        """
+        if event == 'error':
+            # fail in the caller if the args are not valid
+            args = get_exc_info(*args)
+
+        if self._dispatcher is None:
+            self._dispatcher = self.make_dispatcher()
 
-    def once(self, event, f=None):
+        return self._dispatcher.put(event, args, kwargs)
+
+    def make_dispatcher(self):
+        """
+        Return the `AsyncDispatcher` used by `emit_async`.
+        """
+        return AsyncDispatcher(
+            self, size=self.emit_buffer_size, overflow=self.emit_overflow
+        )
+
+    def flush_events(self, timeout=None):
+        """
+        Block until the events queued by `emit_async` have been emitted.
+
+        :returns: Whether the queue is empty.
+        """
+        if self._dispatcher is None:
+            return True
+
+        return self._dispatcher.join(timeout)
+
+    def handle_dispatch_error(self, exc_info):
+        """
+        Called when a listener raises an exception while an event queued by
+        `emit_async` is being emitted. By default the exception is emitted as
+        an 'error' event, or reported by the hub if that is not handled.
+
+        :param exc_info: The exception as returned by ``sys.exc_info()``.
+        """
+        try:
+            self.emit('error', *exc_info)
+        except (Exception, BaseException):
+            gevent.get_hub().handle_error(self, *sys.exc_info())
+
+    def once(self, event, f=None, weak=False):
         """The same as ``ee.on``, except that the listener is automatically
         removed after being called.
         """
         def _once(f):
-            @functools.wraps(f)
-            def g(*args, **kwargs):
-                try:
-                    self.remove_listener(event, g)
-                finally:
-                    f(*args, **kwargs)
+            self.subscribe(event, f, once=True, weak=weak)
 
-            return g
+            return f
 
         if f is None:
-            return lambda f: self.on(event, _once(f))
+            return _once
         else:
-            return self.on(event, _once(f))
+            return _once(f)
 
     def remove_listener(self, event, f):
         """
@@ -167,29 +329,544 @@ class EventEmitter(object):
         it is, unfortunately, not possible to use this with the decorator
         style is.)
 
+        Finding ``f`` takes linear time, use the `Subscription` returned by
+        `subscribe` to remove listeners in constant time.
         """
-        self._events[event].remove(f)
+        for subscription in self._get_events(event).get(event, ()):
+            if subscription.active and subscription.func == f:
+                subscription.cancel()
+
+                return
+
+        raise ValueError('{!r} is not a listener of {!r}'.format(f, event))
 
     def remove_all_listeners(self, event=None):
         """
         Remove all listeners attached to ``event``.
         """
         if event is not None:
-            self._events[event] = []
+            events = [event]
         else:
-            self._events = None
-            self._events = collections.defaultdict(list)
+            events = list(self._events) + list(self._patterns)
+
+        for event in events:
+            for subscription in self._pop(event):
+                subscription.active = False
+
+            self._cancelled.pop(event, None)
 
     def listeners(self, event):
         """
-        Returns the list of all listeners registered to the ``event``.
+        Returns a new list of all listeners registered to the ``event``.
+        """
+        listeners = []
+
+        for subscription in self._get_events(event).get(event, ()):
+            if not subscription.active:
+                continue
+
+            func = subscription.func
+
+            if isinstance(func, WeakListener):
+                func = func.resolve()
+
+                if func is None:
+                    continue
+
+            listeners.append(func)
+
+        return listeners
+
+    def _compact(self, event):
+        """
+        Called when a subscription to ``event`` has been cancelled.
+        """
+        events = self._get_events(event)
+        subscriptions = events[event]
+        cancelled = self._cancelled.get(event, 0) + 1
+
+        if cancelled * 2 <= len(subscriptions):
+            self._cancelled[event] = cancelled
+
+            return
+
+        self._cancelled.pop(event, None)
+
+        # a new list, emits in progress keep iterating the old one
+        subscriptions = [
+            subscription
+            for subscription in subscriptions
+            if subscription.active
+        ]
+
+        if subscriptions:
+            events[event] = subscriptions
+        else:
+            self._pop(event)
+
+    def _get_events(self, event):
+        """
+        Return the dict that holds the subscriptions to ``event``.
+        """
+        if is_pattern(event):
+            return self._patterns
+
+        return self._events
+
+    def _pop(self, event):
         """
-        return self._events[event]
+        Remove and return the subscriptions to ``event``.
+        """
+        events = self._get_events(event)
+        subscriptions = events.pop(event, ())
+
+        if subscriptions and events is self._patterns:
+            self._index.remove(event)
+
+        return subscriptions
+
+
+def put_with_overflow(items, item, overflow, consumer=None):
+    """
+    Put ``item`` in the `gevent.queue.Queue` ``items``, applying the
+    ``overflow`` policy if it is full: 'drop' discards the item and 'block'
+    blocks the current greenlet until there is space. Items put by the hub or
+    by ``consumer`` (the greenlet that empties the queue) are always dropped,
+    blocking would never return.
+
+    :returns: Whether the item was put.
+    """
+    current = gevent.getcurrent()
+    block = (
+        overflow == BLOCK and
+        current is not consumer and
+        current is not gevent.get_hub()
+    )
+
+    try:
+        items.put(item, block=block)
+    except queue.Full:
+        return False
+
+    return True
+
+
+class AsyncDispatcher(object):
+    """
+    Emits the events queued by `EventEmitter.emit_async` from a greenlet, in
+    the order they were queued. The greenlet is only running while there are
+    events in the queue.
+
+    The queue holds at most ``size`` events (`None` means unbounded). When it
+    is full, the ``overflow`` policy applies (see `put_with_overflow`).
+
+    :ivar queued: The number of events queued.
+    :ivar dispatched: The number of events emitted.
+    :ivar dropped: The number of events dropped because the queue was full.
+    :ivar max_depth: The largest number of events that were queued at once.
+    """
+
+    __slots__ = (
+        'emitter',
+        'queue',
+        'overflow',
+        'greenlet',
+        'queued',
+        'dispatched',
+        'dropped',
+        'max_depth',
+    )
+
+    def __init__(self, emitter, size=1000, overflow=DROP):
+        if overflow not in POLICIES:
+            raise ValueError('Unknown overflow policy {!r}'.format(overflow))
+
+        self.emitter = emitter
+        self.queue = queue.Queue(size)
+        self.overflow = overflow
+        self.greenlet = None
+        self.queued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    def put(self, event, args, kwargs):
+        """
+        Queue ``event``, applying the overflow policy if the queue is full.
+
+        :returns: Whether the event was queued.
+        """
+        # a listener emitting on this emitter must not wait for itself
+        if not put_with_overflow(self.queue, (event, args, kwargs),
+                                 self.overflow, consumer=self.greenlet):
+            self.dropped += 1
+
+            return False
+
+        self.queued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self.dispatch)
+
+        return True
+
+    def dispatch(self):
+        """
+        The main loop of the dispatcher greenlet, exits when the queue is
+        empty.
+        """
+        emitter = self.emitter
+
+        try:
+            while True:
+                try:
+                    event, args, kwargs = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    emitter.emit(event, *args, **kwargs)
+                except gevent.GreenletExit:
+                    raise
+                except (Exception, BaseException):
+                    emitter.handle_dispatch_error(sys.exc_info())
+
+                self.dispatched += 1
+        finally:
+            self.greenlet = None
+
+    def join(self, timeout=None):
+        """
+        Wait up to ``timeout`` seconds for the queue to be emptied.
+
+        :returns: Whether the queue is empty.
+        """
+        greenlet = self.greenlet
+
+        if greenlet is not None:
+            greenlet.join(timeout)
+
+        return not self.queue.qsize()
+
+    def stats(self):
+        """
+        Return a dict of the ``depth`` of the queue (the number of events
+        waiting to be emitted), ``max_depth``, ``queued``, ``dispatched`` and
+        ``dropped``.
+        """
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'queued': self.queued,
+            'dispatched': self.dispatched,
+            'dropped': self.dropped,
+        }
+
+
+def call_subscriptions(subscriptions, args, kwargs):
+    """
+    Call the active listeners in ``subscriptions``, see `EventEmitter.emit`.
+    """
+    # Subscriptions are only ever appended to this list, stop at the current
+    # end.
+    for i in xrange(len(subscriptions)):
+        subscription = subscriptions[i]
+
+        if not subscription.active:
+            continue
+
+        if subscription.once:
+            subscription.cancel()
+
+        subscription.func(*args, **kwargs)
+
+
+def is_pattern(event):
+    """
+    Whether ``event`` is a pattern (see `EventEmitter`) rather than an event
+    name.
+    """
+    if not isinstance(event, basestring) or '*' not in event:
+        return False
+
+    for segment in event.split('.'):
+        if segment in ('*', '**'):
+            return True
+
+    return False
+
+
+class PatternIndex(object):
+    """
+    A trie of event patterns, keyed by the '.' separated segments of the
+    patterns (see `EventEmitter`).
+
+    The patterns that match an event are cached. The cache is cleared when a
+    pattern is added or removed and when it holds ``cache_size`` events, so
+    the cost of `match` does not depend on the number of patterns for events
+    that are emitted repeatedly.
+    """
+
+    __slots__ = (
+        'root',
+        'patterns',
+        'cache',
+        'cache_size',
+        '_counter',
+    )
+
+    def __init__(self, cache_size=1000):
+        # a node is a list of [segment -> node, pattern ending at this node]
+        self.root = [{}, None]
+        # pattern -> the order it was added in
+        self.patterns = {}
+        # event -> tuple of matching patterns
+        self.cache = {}
+        self.cache_size = cache_size
+
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, pattern):
+        """
+        Add ``pattern`` to the index.
+
+        :raises ValueError: If a segment contains '*' but is not ``*`` or
+            ``**``.
+        """
+        if pattern in self.patterns:
+            return
+
+        segments = pattern.split('.')
+
+        # validate before touching the trie, so a bad pattern leaves no nodes
+        for segment in segments:
+            if '*' in segment and segment not in ('*', '**'):
+                raise ValueError(
+                    'Invalid segment {!r} in pattern {!r}'.format(
+                        segment, pattern
+                    )
+                )
+
+        node = self.root
+
+        for segment in segments:
+            node = node[0].setdefault(segment, [{}, None])
+
+        node[1] = pattern
+
+        self._counter += 1
+        self.patterns[pattern] = self._counter
+        self.cache.clear()
+
+    def remove(self, pattern):
+        """
+        Remove ``pattern`` from the index.
+        """
+        if self.patterns.pop(pattern, None) is None:
+            return
+
+        segments = pattern.split('.')
+        path = [self.root]
+
+        for segment in segments:
+            path.append(path[-1][0][segment])
+
+        path[-1][1] = None
+
+        # prune the nodes that no longer lead to a pattern
+        for i in xrange(len(segments), 0, -1):
+            children, node_pattern = path[i]
+
+            if children or node_pattern is not None:
+                break
+
+            del path[i - 1][0][segments[i - 1]]
+
+        self.cache.clear()
+
+    def match(self, event):
+        """
+        Return a tuple of the patterns that match ``event`` in the order they
+        were added.
+        """
+        try:
+            return self.cache[event]
+        except KeyError:
+            pass
+
+        matched = set()
+
+        self._match(self.root, event.split('.'), 0, matched)
+
+        result = tuple(sorted(matched, key=self.patterns.get))
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+
+        self.cache[event] = result
+
+        return result
+
+    def _match(self, node, segments, i, matched):
+        children, pattern = node
+
+        if i == len(segments):
+            if pattern is not None:
+                matched.add(pattern)
+        else:
+            for segment in (segments[i], '*'):
+                child = children.get(segment)
+
+                if child is not None:
+                    self._match(child, segments, i + 1, matched)
+
+        child = children.get('**')
+
+        if child is None:
+            return
+
+        # '**' matches any number of the remaining segments
+        for j in xrange(i, len(segments) + 1):
+            self._match(child, segments, j, matched)
+
+
+class Subscription(object):
+    """
+    A listener registered with `EventEmitter.subscribe`.
+
+    :ivar active: Whether the listener will be called when ``event`` is
+        emitted.
+    """
+
+    __slots__ = (
+        'emitter',
+        'event',
+        'func',
+        'once',
+        'active',
+    )
+
+    def __init__(self, emitter, event, func, once=False):
+        self.emitter = emitter
+        self.event = event
+        self.func = func
+        self.once = once
+        self.active = True
+
+    def __repr__(self):
+        return '<{} {!r} -> {!r}{}>'.format(
+            self.__class__.__name__,
+            self.event,
+            self.func,
+            '' if self.active else ' (cancelled)',
+        )
+
+    def cancel(self):
+        """
+        Remove the listener from the emitter. Safe to call more than once and
+        while the event is being emitted.
+        """
+        if not self.active:
+            return
+
+        self.active = False
+
+        self.emitter._compact(self.event)
+
+
+class WeakListener(object):
+    """
+    Calls a listener that is only weakly referenced, doing nothing once it has
+    been garbage collected.
+
+    For bound methods (and `functools.partial` objects wrapping them) the
+    instance is weakly referenced, otherwise the function itself. The
+    ``callback`` is called with the weak reference when the referent is
+    collected.
+    """
+
+    __slots__ = (
+        'ref',
+        'func',
+        'args',
+        'keywords',
+    )
+
+    def __init__(self, f, callback=None):
+        args, keywords = (), None
+
+        if isinstance(f, functools.partial):
+            args, keywords = f.args, f.keywords
+            f = f.func
+
+        if getattr(f, '__self__', None) is not None:
+            self.ref = weakref.ref(f.__self__, callback)
+            self.func = f.__func__
+        else:
+            self.ref = weakref.ref(f, callback)
+            self.func = None
+
+        self.args = args
+        self.keywords = keywords
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.resolve())
+
+    def __eq__(self, other):
+        func = self.resolve()
+
+        return func is not None and func == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def resolve(self):
+        """
+        Return the listener or `None` if it has been garbage collected.
+        """
+        obj = self.ref()
+
+        if obj is None:
+            return None
+
+        if self.func is not None:
+            obj = types.MethodType(self.func, obj, type(obj))
+
+        if self.args or self.keywords:
+            obj = functools.partial(obj, *self.args, **(self.keywords or {}))
+
+        return obj
+
+    def __call__(self, *args, **kwargs):
+        obj = self.ref()
+
+        if obj is None:
+            return
+
+        if self.args:
+            args = self.args + args
+
+        if self.keywords:
+            kwargs = dict(self.keywords, **kwargs)
+
+        if self.func is None:
+            return obj(*args, **kwargs)
+
+        return self.func(obj, *args, **kwargs)
 
 
 @contextlib.contextmanager
 def emit_exceptions(emitter, logger, propagate=True, always_log=False,
-                    emit=True, skip_types=None):
+                    emit=True, skip_types=None, coalescer=None):
     """
     A context manager that wraps a chunk of synchronous code and traps any
     exceptions. If an exception is caught and ``emit`` is ``True`` (the
@@ -232,6 +909,7 @@ def emit_exceptions(emitter, logger, propagate=True, always_log=False,
         logged if there are no error handlers.
     :param skip_types: A list of exception types to avoid trapping. Exceptions
         of these types will be re-raised.
+    :param coalescer: An `ErrorCoalescer` that exceptions are logged through.
     """
     try:
         yield
@@ -240,31 +918,213 @@ def emit_exceptions(emitter, logger, propagate=True, always_log=False,
             raise
 
         exc_info = sys.exc_info()
-        handled = False
-
-        # we have an exception, now to handle it. if the act of emitting the
-        # error event causes an exception to be raised, log it out
-        if emit:
-            try:
-                handled = emitter.emit('error', *exc_info)
-            except (Exception, BaseException) as emit_exc:
-                if skip_types and isinstance(emit_exc, skip_types):
-                    emit_exc = None
-                    handled = True
-
-                if emit_exc is not None and emit_exc is not exc:
-                    logger.exception(
-                        'Exception raised while emitting error event',
-                        exc_info=sys.exc_info()
-                    )
 
-        if not handled or always_log:
-            logger.error('Exception was caught', exc_info=exc_info)
+        handle_exception(
+            emitter,
+            logger,
+            exc_info,
+            always_log=always_log,
+            emit=emit,
+            skip_types=skip_types,
+            coalescer=coalescer,
+        )
 
         if propagate:
             raise exc_info[0], exc_info[1], exc_info[2]
 
 
+def handle_exception(emitter, logger, exc_info, always_log=False, emit=True,
+                     skip_types=None, coalescer=None):
+    """
+    Handle an exception that has been trapped (see `emit_exceptions`): emit
+    it as an ``error`` event from ``emitter`` and log it if it was not handled.
+
+    :param exc_info: The exception as returned by ``sys.exc_info()``.
+    """
+    handled = False
+
+    # if the act of emitting the error event causes an exception to be raised,
+    # log it out
+    if emit:
+        try:
+            handled = emitter.emit('error', *exc_info)
+        except (Exception, BaseException) as emit_exc:
+            if skip_types and isinstance(emit_exc, skip_types):
+                emit_exc = None
+                handled = True
+
+            if emit_exc is not None and emit_exc is not exc_info[1]:
+                logger.exception(
+                    'Exception raised while emitting error event',
+                    exc_info=sys.exc_info()
+                )
+
+    if not handled or always_log:
+        if coalescer is not None:
+            coalescer.log(logger, exc_info)
+        else:
+            logger.error('Exception was caught', exc_info=exc_info)
+
+
+def get_location(exc_info):
+    """
+    Return ``(exc_type, filename, lineno)`` of where the exception in
+    ``exc_info`` was raised.
+    """
+    tb = exc_info[2]
+
+    if tb is None:
+        return exc_info[0], None, None
+
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+
+    return exc_info[0], tb.tb_frame.f_code.co_filename, tb.tb_lineno
+
+
+def get_message(exc):
+    """
+    Return the message of the exception ``exc`` as unicode, falling back to
+    its ``repr`` if it cannot be decoded.
+    """
+    try:
+        return unicode(exc)
+    except (Exception, BaseException):
+        return repr(exc).decode('ascii', 'replace')
+
+
+class ErrorCoalescer(object):
+    """
+    Logs storms of identical exceptions (the same type raised from the same
+    place) as a summary instead of logging every traceback.
+
+    The first ``samples`` occurrences of each exception within a ``window``
+    of seconds are logged in full, the rest are counted. At the end of the
+    window a summary of the counts is logged and the ``emitter`` emits the
+    'error_summary' event with a list of dicts with the keys ``type``,
+    ``message`` (of the first occurrence), ``filename``, ``lineno``,
+    ``count`` and ``suppressed``.
+
+    :ivar suppressed: The total number of tracebacks that were not logged.
+    """
+
+    def __init__(self, emitter, window=1.0, samples=1):
+        self.emitter = emitter
+        self.window = window
+        self.samples = samples
+        self.suppressed = 0
+
+        # location -> [count, message]
+        self._errors = collections.OrderedDict()
+        self._window_start = None
+        self._logger = None
+        self._timer = None
+
+    def log(self, logger, exc_info):
+        """
+        Log the exception with ``logger`` unless enough identical exceptions
+        have already been logged in this window.
+
+        :returns: Whether the traceback was logged.
+        """
+        try:
+            suppress = self.count(logger, exc_info)
+        except (Exception, BaseException):
+            # the coalescer must never break the handling of the exception
+            suppress = False
+
+        if not suppress:
+            logger.error('Exception was caught', exc_info=exc_info)
+
+            return True
+
+        self.suppressed += 1
+
+        return False
+
+    def count(self, logger, exc_info):
+        """
+        Count the exception in the current window.
+
+        :returns: Whether enough identical exceptions have already been logged
+            in this window for the traceback to be suppressed.
+        """
+        if self._window_start is None:
+            self._window_start = time.time()
+            self._logger = logger
+            self._timer = gevent.spawn_later(self.window, self.flush)
+
+        location = get_location(exc_info)
+        entry = self._errors.get(location)
+
+        if entry is None:
+            entry = self._errors[location] = [
+                0, get_message(exc_info[1])
+            ]
+
+        entry[0] += 1
+
+        return entry[0] > self.samples
+
+    def flush(self):
+        """
+        End the current window, logging and emitting the summary of the
+        exceptions that were not logged.
+
+        :returns: The summary.
+        """
+        timer, self._timer = self._timer, None
+
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill(block=False)
+
+        if self._window_start is None:
+            return []
+
+        duration = time.time() - self._window_start
+        errors = self._errors
+        logger = self._logger
+
+        self._errors = collections.OrderedDict()
+        self._window_start = None
+        self._logger = None
+
+        summary = []
+
+        for location, (count, message) in errors.items():
+            if count <= self.samples:
+                continue
+
+            exc_type, filename, lineno = location
+
+            summary.append({
+                'type': exc_type,
+                'message': message,
+                'filename': filename,
+                'lineno': lineno,
+                'count': count,
+                'suppressed': count - self.samples,
+            })
+
+        if not summary:
+            return summary
+
+        logger.error(
+            u'{} exception(s) suppressed in the last {:.1f}s:\n{}',
+            sum(entry['suppressed'] for entry in summary),
+            duration,
+            u'\n'.join(
+                u'  {count} x {name}: {message} ({filename}:{lineno})'.format(
+                    name=entry['type'].__name__, **entry
+                ) for entry in summary
+            ),
+        )
+
+        self.emitter.emit('error_summary', summary)
+
+        return summary
+
+
 def get_exc_info(*args):
     """
     From a list of arguments, return a value that matches the format of
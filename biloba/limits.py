@@ -0,0 +1,353 @@
+"""
+Limiters that protect services (and whatever they call) from overload.
+"""
+
+import collections
+import time
+
+import gevent
+from gevent import event
+
+
+__all__ = [
+    'AdaptiveLimiter',
+    'RateLimiter',
+]
+
+
+class AdaptiveLimiter(object):
+    """
+    A concurrency limit that adapts to the observed latency of the work it
+    admits, using additive increase/multiplicative decrease (AIMD).
+
+    Every completed task reports its latency via `release`. While latencies
+    are below ``target`` and the limit is being used, the limit grows by
+    ``increase`` for every ``limit`` completed tasks. When a latency is above
+    ``target`` the limit is multiplied by ``backoff`` (at most once per
+    ``target`` seconds, so a burst of slow tasks counts as one signal).
+
+    :ivar limit: The current limit (a float, see `size`).
+    :ivar in_flight: The number of tasks that have been admitted and not yet
+        released.
+    :ivar increases: The number of times the limit was raised.
+    :ivar decreases: The number of times the limit was lowered.
+    """
+
+    __slots__ = (
+        'target',
+        'limit',
+        'min_limit',
+        'max_limit',
+        'increase',
+        'backoff',
+        'in_flight',
+        'increases',
+        'decreases',
+        '_last_decrease',
+        '_waiters',
+    )
+
+    def __init__(self, target, initial=10, min_limit=1, max_limit=1000,
+                 increase=1.0, backoff=0.9):
+        self.target = target
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+
+        self._last_decrease = None
+        self._waiters = collections.deque()
+
+    @property
+    def size(self):
+        """
+        The number of tasks that may be in flight.
+        """
+        return max(self.min_limit, int(self.limit))
+
+    def full(self):
+        return self.in_flight >= self.size
+
+    def acquire(self):
+        """
+        Admit a task, blocking while the limit is reached.
+        """
+        while self.full():
+            waiter = event.Event()
+
+            self._waiters.append(waiter)
+
+            try:
+                waiter.wait()
+            finally:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+        self.in_flight += 1
+
+    def release(self, latency=None, now=None):
+        """
+        Called when an admitted task has completed.
+
+        :param latency: The number of seconds the task took or `None` if it
+            should not affect the limit.
+        """
+        self.in_flight -= 1
+
+        if latency is not None:
+            self.update(latency, now)
+
+        # wake up as many waiters as there are free slots
+        for _ in range(min(len(self._waiters), self.size - self.in_flight)):
+            self._waiters.popleft().set()
+
+    def update(self, latency, now=None):
+        """
+        Adjust the limit for a task that took ``latency`` seconds.
+        """
+        if now is None:
+            now = time.time()
+
+        if latency > self.target:
+            if (self._last_decrease is not None and
+                    now - self._last_decrease < self.target):
+                return
+
+            self._last_decrease = now
+
+            limit = max(self.min_limit, self.limit * self.backoff)
+
+            if limit < self.limit:
+                self.limit = limit
+                self.decreases += 1
+
+            return
+
+        # only grow the limit if it is actually being used
+        if (self.in_flight + 1) * 2 < self.size:
+            return
+
+        limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+        if limit > self.limit:
+            self.limit = limit
+            self.increases += 1
+
+
+class TokenBucket(object):
+    """
+    The state of a single key of a `RateLimiter`.
+
+    :ivar tokens: The number of tokens available.
+    :ivar last_used: When the bucket was last acquired from.
+    :ivar updated: When the tokens were last topped up.
+    :ivar waiters: A deque of ``[tokens, event]`` for the greenlets waiting
+        for tokens, in the order they arrived.
+    """
+
+    __slots__ = (
+        'tokens',
+        'last_used',
+        'updated',
+        'waiters',
+    )
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last_used = now
+        self.updated = now
+        self.waiters = collections.deque()
+
+
+class RateLimiter(object):
+    """
+    A token bucket rate limiter with a bucket per key. Each bucket holds at
+    most ``burst`` tokens and is refilled at ``rate`` tokens per second.
+
+    The tokens accrued since a bucket was last used are added when it is
+    acquired from. Greenlets waiting for tokens are woken, in the order they
+    arrived, by a timer on the event loop that refills the buckets every
+    ``interval`` seconds while the limiter is started (see `start`), usually
+    by the service that owns it (see
+    `biloba.service.Service.make_rate_limiter`).
+
+    Buckets that are full and have not been used for ``idle_timeout`` seconds
+    are evicted, so the memory used is bounded by the number of keys active
+    within that time.
+
+    :ivar buckets: An ordered dict of key -> `TokenBucket`, least recently
+        used first.
+    :ivar evicted: The number of buckets that have been evicted.
+    """
+
+    def __init__(self, rate, burst=None, idle_timeout=60.0, interval=0.1):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+
+        self.buckets = collections.OrderedDict()
+        self.evicted = 0
+
+        # the keys of the buckets that are not full
+        self._filling = set()
+        self._timer = None
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def started(self):
+        return self._timer is not None
+
+    def start(self):
+        """
+        Start the refill timer. Must be called in the thread running the hub.
+        """
+        if self._timer is not None:
+            return
+
+        self._timer = gevent.get_hub().loop.timer(self.interval, self.interval)
+        self._timer.start(self.refill)
+
+    def stop(self):
+        """
+        Stop the refill timer. Greenlets waiting for tokens keep waiting until
+        the limiter is started again.
+        """
+        if self._timer is None:
+            return
+
+        self._timer.stop()
+        self._timer = None
+
+    def get_bucket(self, key, now):
+        bucket = self.buckets.pop(key, None)
+
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+        else:
+            bucket.last_used = now
+
+        # keep the buckets in order of use
+        self.buckets[key] = bucket
+
+        return bucket
+
+    def acquire(self, key=None, tokens=1, block=True, timeout=None):
+        """
+        Take ``tokens`` from the bucket of ``key``, waiting up to ``timeout``
+        seconds (forever if `None`) for them if ``block`` is `True`.
+
+        :returns: Whether the tokens were acquired.
+        """
+        if tokens > self.burst:
+            raise ValueError(
+                'Cannot acquire {} tokens, burst is {}'.format(
+                    tokens, self.burst
+                )
+            )
+
+        now = time.time()
+        bucket = self.get_bucket(key, now)
+
+        self.top_up(bucket, now)
+
+        if not bucket.waiters and bucket.tokens >= tokens:
+            bucket.tokens -= tokens
+            self._filling.add(key)
+
+            return True
+
+        if not block:
+            return False
+
+        waiter = [tokens, event.Event()]
+
+        bucket.waiters.append(waiter)
+        self._filling.add(key)
+
+        try:
+            waiter[1].wait(timeout)
+        finally:
+            if not waiter[1].is_set():
+                bucket.waiters.remove(waiter)
+
+        # `refill` may have taken the tokens for this waiter just as the
+        # timeout expired
+        return waiter[1].is_set()
+
+    def top_up(self, bucket, now):
+        """
+        Add the tokens accrued since ``bucket`` was last topped up.
+        """
+        elapsed = now - bucket.updated
+
+        if elapsed > 0:
+            tokens = bucket.tokens + elapsed * self.rate
+            bucket.tokens = min(self.burst, tokens)
+            bucket.updated = now
+
+    def refill(self):
+        """
+        Add the tokens accrued since the last refill to the buckets, wake up
+        the waiters that can be satisfied and evict idle buckets. Called by
+        the timer.
+        """
+        now = time.time()
+
+        for key in list(self._filling):
+            bucket = self.buckets.get(key)
+
+            if bucket is None:
+                self._filling.discard(key)
+
+                continue
+
+            self.top_up(bucket, now)
+
+            if bucket.waiters and bucket.tokens >= bucket.waiters[0][0]:
+                # keep the buckets in order of use, see `evict`
+                self.get_bucket(key, now)
+
+            while bucket.waiters and bucket.tokens >= bucket.waiters[0][0]:
+                amount, waiter = bucket.waiters.popleft()
+
+                bucket.tokens -= amount
+
+                waiter.set()
+
+            if bucket.tokens >= self.burst:
+                self._filling.discard(key)
+
+        self.evict(now)
+
+    def evict(self, now=None):
+        """
+        Remove the buckets that are full and have been idle for longer than
+        ``idle_timeout``.
+        """
+        if now is None:
+            now = time.time()
+
+        expired = now - self.idle_timeout
+        keys = []
+
+        for key, bucket in self.buckets.iteritems():
+            if bucket.last_used > expired:
+                # the rest have been used more recently
+                break
+
+            if not bucket.waiters and key not in self._filling:
+                keys.append(key)
+
+        for key in keys:
+            del self.buckets[key]
+
+        self.evicted += len(keys)
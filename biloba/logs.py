@@ -0,0 +1,197 @@
+"""
+Log records written by a service instead of the greenlet that logged them.
+"""
+
+from gevent import queue
+import logbook
+
+from biloba import events, service
+
+
+__all__ = [
+    'AsyncLogService',
+]
+
+
+# the overflow policies, see `biloba.events.put_with_overflow`
+DROP = events.DROP
+BLOCK = events.BLOCK
+
+# tells the flusher to stop
+_STOP = object()
+
+
+class QueueHandler(logbook.Handler):
+    """
+    A logbook handler that puts records in to the buffer of an
+    `AsyncLogService`.
+    """
+
+    def __init__(self, log_service, level=logbook.NOTSET, filter=None,
+                 bubble=False):
+        logbook.Handler.__init__(self, level, filter, bubble)
+
+        self.log_service = log_service
+
+    def emit(self, record):
+        # the frame of the record is about to go away
+        record.pull_information()
+
+        self.log_service.put(record)
+
+
+class AsyncLogService(service.Service):
+    """
+    Handles all log records (via a handler pushed to the logbook application
+    stack while this service is running) by buffering them and passing them
+    to ``handler`` in batches of up to ``log_batch_size`` from a dedicated
+    greenlet, so slow handlers (files, sockets) do not stall the greenlets
+    that log.
+
+    The buffer holds at most ``log_buffer_size`` records. When it is full,
+    the ``log_overflow`` policy applies (see
+    `biloba.events.put_with_overflow`), records logged by the flusher itself
+    are dropped. If ``log_in_thread`` is set, the batches are handled in a
+    native thread (see `biloba.service.Service.run_in_thread`).
+
+    All buffered records are handled before this service stops. To capture
+    the logs of the other services while they stop, make them depend on this
+    service::
+
+        log_service = AsyncLogService(logbook.FileHandler('app.log'))
+
+        app.add_service(log_service)
+        app.add_service(web, depends_on=[log_service])
+
+    :ivar handler: The logbook handler that the records are passed to.
+    :ivar buffer: The queue of records that have not been handled yet.
+    :ivar written: The number of records passed to ``handler``.
+    :ivar dropped: The number of records dropped because the buffer was full.
+    :ivar batches: The number of batches passed to ``handler``.
+    """
+
+    __slots__ = (
+        'handler',
+        'queue_handler',
+        'buffer',
+        'written',
+        'dropped',
+        'batches',
+        '_flusher',
+    )
+
+    # the maximum number of records waiting to be handled
+    log_buffer_size = 10000
+    # the maximum number of records handled in one go
+    log_batch_size = 100
+    # what happens when the buffer is full, one of 'drop' or 'block'
+    log_overflow = DROP
+    # whether the records are handled in a native thread
+    log_in_thread = False
+
+    def __init__(self, handler, logger=None):
+        super(AsyncLogService, self).__init__(logger=logger)
+
+        overflow = self.get_option('log_overflow')
+
+        if overflow not in events.POLICIES:
+            raise ValueError('Unknown overflow policy {!r}'.format(overflow))
+
+        self.handler = handler
+        self.queue_handler = QueueHandler(self, level=handler.level)
+        self.buffer = queue.Queue(self.get_option('log_buffer_size'))
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self._flusher = None
+
+    def do_start(self):
+        self.queue_handler.push_application()
+
+        self._flusher = self.spawn(self.flush_records)
+
+    def do_teardown(self):
+        self.queue_handler.pop_application()
+
+        if self._flusher is None:
+            return
+
+        # let the flusher handle everything in the buffer before it stops
+        self.buffer.put(_STOP)
+        self._flusher.join()
+        self._flusher = None
+
+    def put(self, record):
+        """
+        Add ``record`` to the buffer, applying the overflow policy if it is
+        full.
+        """
+        if not events.put_with_overflow(self.buffer, record,
+                                        self.get_option('log_overflow'),
+                                        consumer=self._flusher):
+            self.dropped += 1
+
+    def flush_records(self):
+        """
+        The main loop of the flusher greenlet.
+        """
+        batch_size = self.get_option('log_batch_size')
+        stopping = False
+
+        while True:
+            if not stopping:
+                records = [self.buffer.get()]
+            elif not self.buffer.empty():
+                records = []
+            else:
+                return
+
+            while len(records) < batch_size:
+                try:
+                    records.append(self.buffer.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _STOP in records:
+                stopping = True
+                records = [record for record in records if record is not _STOP]
+
+            if not records:
+                continue
+
+            if self.get_option('log_in_thread'):
+                self.run_in_thread(self.handle_records, records)
+            else:
+                self.handle_records(records)
+
+    def handle_records(self, records):
+        """
+        Pass a batch of records to ``handler``.
+        """
+        handler = self.handler
+
+        for record in records:
+            if handler.should_handle(record):
+                handler.handle(record)
+
+        self.written += len(records)
+        self.batches += 1
+
+    def stats(self):
+        """
+        The same as `biloba.service.Service.stats` with the addition of:
+
+        - ``buffered``: The number of records waiting to be handled.
+        - ``written``: The number of records that have been handled.
+        - ``dropped``: The number of records dropped by the overflow policy.
+        """
+        snapshot = super(AsyncLogService, self).stats()
+
+        snapshot.update({
+            'buffered': self.buffer.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        })
+
+        return snapshot
@@ -0,0 +1,123 @@
+"""
+Cheap runtime metrics kept by every `biloba.service.Service`.
+"""
+
+import math
+import time
+
+
+__all__ = [
+    'Meter',
+    'ServiceMetrics',
+]
+
+
+#: the keys of a `biloba.service.Service.stats` snapshot that are summed over
+#: the service tree in its 'total'.
+TOTALS = (
+    'live',
+    'spawned',
+    'spawn_rate',
+    'children',
+)
+
+
+class Meter(object):
+    """
+    Measures the rate of events per second as an exponentially decaying
+    average. The decay is applied lazily when the meter is marked or read so
+    an idle meter costs nothing.
+
+    :ivar count: The total number of events.
+    :ivar half_life: The number of seconds after which an event contributes
+        half as much to the rate.
+    """
+
+    __slots__ = (
+        'count',
+        'half_life',
+        '_value',
+        '_last',
+    )
+
+    def __init__(self, half_life=10.0):
+        self.count = 0
+        self.half_life = half_life
+
+        self._value = 0.0
+        self._last = None
+
+    def _decay(self, now):
+        if self._last is not None and now > self._last:
+            self._value *= math.exp(
+                -math.log(2) * (now - self._last) / self.half_life
+            )
+
+        self._last = now
+
+    def mark(self, n=1, now=None):
+        """
+        Record ``n`` events.
+        """
+        self._decay(time.time() if now is None else now)
+
+        self.count += n
+        self._value += n
+
+    def rate(self, now=None):
+        """
+        Return the current rate of events per second.
+        """
+        self._decay(time.time() if now is None else now)
+
+        return self._value * math.log(2) / self.half_life
+
+
+class ServiceMetrics(object):
+    """
+    The counters kept by a single service.
+
+    :ivar spawned: The number of greenlets spawned by the service.
+    :ivar spawn_rate: A `Meter` of greenlets spawned.
+    :ivar errors: The number of 'error' events emitted by the service. This
+        includes errors forwarded from child services.
+    :ivar start_duration: The number of seconds the last start took (including
+        starting the child services).
+    :ivar stop_duration: The number of seconds the last stop took.
+    """
+
+    __slots__ = (
+        'spawned',
+        'spawn_rate',
+        'errors',
+        'start_duration',
+        'stop_duration',
+    )
+
+    def __init__(self):
+        self.spawned = 0
+        self.spawn_rate = Meter()
+        self.errors = 0
+        self.start_duration = None
+        self.stop_duration = None
+
+    def spawn(self):
+        """
+        Record a spawned greenlet.
+        """
+        self.spawned += 1
+        self.spawn_rate.mark()
+
+
+def aggregate(snapshot, children):
+    """
+    Return the 'total' of ``snapshot`` and the snapshots of its ``children``
+    for each of the `TOTALS`.
+    """
+    total = dict((key, snapshot[key]) for key in TOTALS)
+
+    for child in children:
+        for key in TOTALS:
+            total[key] += child['total'][key]
+
+    return total
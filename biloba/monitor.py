@@ -0,0 +1,316 @@
+"""
+Tools to find greenlets that misbehave inside a service tree.
+"""
+
+import collections
+import sys
+import time
+import traceback
+
+import gevent
+from gevent import monkey
+import greenlet
+
+from biloba import service as biloba_service
+
+
+__all__ = [
+    'BlockingMonitor',
+    'CPUTracer',
+]
+
+
+# the monitor thread must be a real thread even if the process is monkey
+# patched
+_start_new_thread = monkey.get_original('thread', 'start_new_thread')
+_get_ident = monkey.get_original('thread', 'get_ident')
+_allocate_lock = monkey.get_original('thread', 'allocate_lock')
+_sleep = monkey.get_original('time', 'sleep')
+
+
+class BlockingMonitor(object):
+    """
+    Detects greenlets that block the gevent hub (i.e. run without yielding)
+    for longer than ``threshold`` seconds.
+
+    A native thread checks every ``interval`` seconds whether the hub has
+    switched between greenlets. When it has not, the stack of the greenlet
+    that is running is captured and handed back to the hub. Once the hub is
+    running again, the service that spawned the greenlet (see
+    `biloba.service.Service.spawn`) or ``service`` if it is not known emits the
+    'blocked' event with ``(greenlet, duration, stack)`` and a warning is
+    logged with its logger.
+
+    Usage::
+
+        monitor = BlockingMonitor(my_service, threshold=0.1)
+        monitor.start()
+
+        my_service.join()
+
+        monitor.stop()
+
+    :ivar service: The service that reports greenlets not spawned by a service.
+    :ivar threshold: The number of seconds a greenlet may run for without
+        yielding before it is reported.
+    :ivar interval: The number of seconds between checks.
+    :ivar reports: The number of blocking greenlets that have been reported.
+    """
+
+    def __init__(self, service, threshold=0.1, interval=None):
+        self.service = service
+        self.threshold = threshold
+        self.interval = interval or threshold / 4.0
+        self.reports = 0
+
+        self._running = False
+        self._switches = 0
+        self._active = None
+        self._previous_trace = None
+        self._hub = None
+        self._thread_ident = None
+        self._async = None
+        self._pending = collections.deque()
+        self._done = None
+
+    def start(self):
+        """
+        Start monitoring. Must be called from the thread running the hub.
+        """
+        if self._running:
+            return
+
+        self._running = True
+        self._hub = gevent.get_hub()
+        self._thread_ident = _get_ident()
+
+        # `async` is a keyword in newer pythons, gevent later renamed the
+        # watcher to `async_`
+        make_async = getattr(self._hub.loop, 'async_', None)
+
+        if make_async is None:
+            make_async = getattr(self._hub.loop, 'async')
+
+        self._async = make_async()
+        self._async.start(self._deliver)
+
+        self._previous_trace = greenlet.settrace(self._trace)
+
+        # held by the monitor thread until it exits
+        self._done = _allocate_lock()
+        self._done.acquire()
+
+        _start_new_thread(self._monitor, ())
+
+    def stop(self):
+        """
+        Stop monitoring and wait (up to ``interval`` seconds) for the monitor
+        thread to exit.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+
+        greenlet.settrace(self._previous_trace)
+        self._previous_trace = None
+
+        self._async.stop()
+        self._async = None
+
+        self._done.acquire()
+        self._done.release()
+
+    def _trace(self, event, args):
+        # called on every greenlet switch, keep it cheap
+        self._switches += 1
+        self._active = args[1]
+
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _monitor(self):
+        # runs in a native thread
+        try:
+            self._check()
+        finally:
+            self._done.release()
+
+    def _check(self):
+        switches = None
+        since = None
+        reported = None
+
+        while self._running:
+            _sleep(self.interval)
+
+            now = time.time()
+
+            if self._switches != switches:
+                switches = self._switches
+                since = now
+
+                continue
+
+            active = self._active
+
+            if active is None or active is self._hub:
+                # idle in the event loop
+                continue
+
+            if reported == switches or now - since < self.threshold:
+                continue
+
+            reported = switches
+
+            frame = sys._current_frames().get(self._thread_ident)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+
+            self._pending.append((active, now - since, stack))
+
+            watcher = self._async
+
+            if watcher is not None:
+                watcher.send()
+
+    def _deliver(self):
+        # called in the hub once it is no longer blocked
+        while self._pending:
+            thread, duration, stack = self._pending.popleft()
+
+            gevent.spawn(self.report, thread, duration, stack)
+
+    def report(self, thread, duration, stack):
+        """
+        Called with each greenlet that blocked the hub for at least
+        ``duration`` seconds.
+        """
+        self.reports += 1
+
+        owner = getattr(thread, 'service', None) or self.service
+
+        owner.logger.warning(
+            '{!r} blocked the hub for at least {:.3f}s in {!r}:\n{}',
+            thread, duration, owner, stack
+        )
+
+        owner.emit('blocked', thread, duration, stack)
+
+
+class CPUTracer(object):
+    """
+    Measures how long each greenlet spawned by a service (see
+    `biloba.service.Service.spawn`) runs for between switches and attributes
+    the time to the service that spawned it.
+
+    Tracing adds a call to `time.time` and a dict update to every greenlet
+    switch, cheap enough to be left on.
+
+    Usage::
+
+        tracer = CPUTracer(my_service)
+        tracer.start()
+
+        ...
+
+        for row in tracer.report(10):
+            print row['name'], row['inclusive'], row['self']
+
+    :ivar service: The root of the service tree that is reported on.
+    :ivar times: A dict of service -> seconds spent running greenlets spawned
+        by that service.
+    :ivar switches: A dict of service -> the number of times greenlets spawned
+        by that service were switched out.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.times = {}
+        self.switches = {}
+
+        self._running = False
+        self._last = None
+        self._previous_trace = None
+
+    def start(self):
+        """
+        Start tracing. Must be called from the thread running the hub.
+        """
+        if self._running:
+            return
+
+        self._running = True
+        self._last = time.time()
+        self._previous_trace = greenlet.settrace(self._trace)
+
+    def stop(self):
+        """
+        Stop tracing. The collected times are kept until `reset`.
+        """
+        if not self._running:
+            return
+
+        self._running = False
+
+        greenlet.settrace(self._previous_trace)
+        self._previous_trace = None
+
+    def reset(self):
+        """
+        Forget all the collected times.
+        """
+        self.times = {}
+        self.switches = {}
+
+    def _trace(self, event, args):
+        now = time.time()
+        owner = getattr(args[0], 'service', None)
+
+        if owner is not None:
+            self.times[owner] = self.times.get(owner, 0.0) + now - self._last
+            self.switches[owner] = self.switches.get(owner, 0) + 1
+
+        self._last = now
+
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def report(self, limit=None):
+        """
+        Return a list of dicts, one per service in the tree, ordered by the
+        time spent in the service and its descendants (most first):
+
+        - ``service``: The service.
+        - ``name``: The name of the service class.
+        - ``self``: Seconds spent in greenlets spawned by the service.
+        - ``inclusive``: ``self`` plus the time of all descendants.
+        - ``switches``: The number of times greenlets spawned by the service
+          were switched out.
+
+        :param limit: Return only the top ``limit`` services.
+        """
+        rows = []
+
+        def visit(service):
+            row = {
+                'service': service,
+                'name': service.__class__.__name__,
+                'self': self.times.get(service, 0.0),
+                'switches': self.switches.get(service, 0),
+            }
+
+            row['inclusive'] = row['self']
+
+            rows.append(row)
+
+            for child in service.services:
+                if isinstance(child, biloba_service.Service):
+                    row['inclusive'] += visit(child)
+
+            return row['inclusive']
+
+        visit(self.service)
+
+        rows.sort(key=lambda row: row['inclusive'], reverse=True)
+
+        return rows[:limit]
@@ -0,0 +1,193 @@
+"""
+Greenlet pools that apply backpressure when they are full.
+"""
+
+import collections
+import time
+
+from gevent import pool
+
+from biloba import limits
+
+
+__all__ = [
+    'AdaptivePool',
+    'BoundedPool',
+    'PoolFull',
+    'BLOCK',
+    'FAIL',
+    'QUEUE',
+]
+
+
+#: wait for a free slot before starting the greenlet
+BLOCK = 'block'
+#: raise `PoolFull` immediately
+FAIL = 'fail'
+#: park the greenlet in a bounded backlog, it will be started when a slot
+#: becomes available
+QUEUE = 'queue'
+
+POLICIES = (BLOCK, FAIL, QUEUE)
+
+
+class PoolFull(Exception):
+    """
+    Raised when a greenlet cannot be added to a full `BoundedPool`.
+    """
+
+
+class BoundedPool(pool.Pool):
+    """
+    A `gevent.pool.Pool` that limits the number of concurrently running
+    greenlets and keeps count of how often callers hit that limit.
+
+    What happens when the pool is full depends on the ``policy``:
+
+    - `BLOCK`: the caller is blocked until a slot becomes free.
+    - `FAIL`: `PoolFull` is raised.
+    - `QUEUE`: the greenlet is added to a backlog of at most ``backlog``
+      greenlets and is started as soon as a slot is released. The greenlet
+      is returned (unstarted) to the caller. `PoolFull` is raised if the
+      backlog is full.
+
+    :ivar waits: The number of times a caller was blocked waiting for a slot.
+    :ivar wait_time: The total time (in seconds) callers spent blocked.
+    :ivar rejected: The number of greenlets refused with `PoolFull`.
+    :ivar queued: The number of greenlets that were put in to the backlog.
+    """
+
+    def __init__(self, size, policy=BLOCK, backlog=0):
+        if policy not in POLICIES:
+            raise ValueError('Unknown pool policy {!r}'.format(policy))
+
+        super(BoundedPool, self).__init__(size)
+
+        self.policy = policy
+        self.max_backlog = backlog
+        self.backlog = collections.deque()
+
+        self.waits = 0
+        self.wait_time = 0.0
+        self.rejected = 0
+        self.queued = 0
+
+    def add(self, greenlet):
+        """
+        Begin tracking ``greenlet``, applying the pool policy if it is full.
+        """
+        if not self.full() or self.policy == QUEUE:
+            return super(BoundedPool, self).add(greenlet)
+
+        if self.policy == FAIL:
+            self.rejected += 1
+
+            raise PoolFull('Pool is full (size:{})'.format(self.size))
+
+        self.waits += 1
+        start = time.time()
+
+        try:
+            super(BoundedPool, self).add(greenlet)
+        finally:
+            self.wait_time += time.time() - start
+
+    def start(self, greenlet):
+        """
+        Start ``greenlet`` in this pool. If the policy is `QUEUE` and the pool
+        is full the greenlet will be started later.
+        """
+        if self.policy != QUEUE or not self.full():
+            return super(BoundedPool, self).start(greenlet)
+
+        if len(self.backlog) >= self.max_backlog:
+            self.rejected += 1
+
+            raise PoolFull(
+                'Pool backlog is full (size:{}, backlog:{})'.format(
+                    self.size, self.max_backlog
+                )
+            )
+
+        self.queued += 1
+        self.backlog.append(greenlet)
+
+    def _discard(self, greenlet):
+        if not self.backlog or greenlet not in self.greenlets:
+            return super(BoundedPool, self)._discard(greenlet)
+
+        # hand the slot of the finished greenlet straight over to the next
+        # one in the backlog. the pool never appears empty while there is
+        # queued work so `join` behaves as expected.
+        self.greenlets.discard(greenlet)
+        self.dying.discard(greenlet)
+
+        next_greenlet = self.backlog.popleft()
+
+        pool.Group.add(self, next_greenlet)
+        next_greenlet.start()
+
+    def kill(self, *args, **kwargs):
+        """
+        Kill all greenlets in the pool, queued greenlets are never started.
+        """
+        while self.backlog:
+            self.backlog.popleft().kill(block=False)
+
+        return super(BoundedPool, self).kill(*args, **kwargs)
+
+
+class AdaptivePool(pool.Group):
+    """
+    A greenlet group whose concurrency limit adapts to keep the time each
+    greenlet takes to complete under ``target`` seconds (see
+    `biloba.limits.AdaptiveLimiter`). Callers are blocked while the limit is
+    reached.
+
+    :ivar limiter: The `biloba.limits.AdaptiveLimiter` of this pool.
+    """
+
+    def __init__(self, target, max_size=None, **kwargs):
+        super(AdaptivePool, self).__init__()
+
+        if max_size is not None:
+            kwargs['max_limit'] = max_size
+
+        self.limiter = limits.AdaptiveLimiter(target, **kwargs)
+        self._started = {}
+
+    @property
+    def size(self):
+        """
+        The current concurrency limit.
+        """
+        return self.limiter.size
+
+    def full(self):
+        return self.limiter.full()
+
+    def add(self, greenlet):
+        """
+        Begin tracking ``greenlet``, blocking while the pool is full.
+        """
+        if greenlet in self.greenlets:
+            return
+
+        self.limiter.acquire()
+
+        try:
+            super(AdaptivePool, self).add(greenlet)
+        except (Exception, BaseException):
+            self.limiter.release()
+
+            raise
+
+        self._started[greenlet] = time.time()
+
+    def _discard(self, greenlet):
+        super(AdaptivePool, self)._discard(greenlet)
+
+        started = self._started.pop(greenlet, None)
+
+        if started is not None:
+            self.limiter.release(time.time() - started)
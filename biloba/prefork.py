@@ -0,0 +1,245 @@
+"""
+Scale a service tree across multiple cores by forking worker processes.
+"""
+
+import errno
+import multiprocessing
+import os
+import signal
+import sys
+
+import gevent
+from gevent import event, os as gevent_os, queue, socket
+
+from biloba import config as biloba_config, service
+
+
+__all__ = [
+    'ProcessSupervisorService',
+]
+
+
+def make_listener(address, backlog):
+    """
+    Return a listening TCP socket bound to ``address``.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+
+    return sock
+
+
+class ProcessSupervisorService(service.ConfigurableService):
+    """
+    Forks a number of worker processes, each of which runs its own copy of the
+    service tree returned by `make_worker_service`.
+
+    Listening sockets are created (see `make_sockets`) before any workers
+    are forked so that all workers accept connections from the same sockets.
+
+    Workers that exit are respawned until this service is stopped. Stopping
+    this service sends ``SIGTERM`` to every worker (which stops the worker
+    service tree) and waits ``kill_timeout`` seconds before resorting to
+    ``SIGKILL``.
+
+    The supervisor should be the root service of the parent process; anything
+    else running in the parent when a worker is forked is inherited by it.
+
+    Config options:
+
+    - ``workers``: The number of worker processes (defaults to the number
+      of cpus).
+    - ``listen``: A list of ``host:port`` addresses to listen on.
+    - ``listen_backlog``: The backlog of each listening socket.
+    - ``respawn_delay``: Seconds to wait before replacing a dead worker.
+    - ``kill_timeout``: Seconds to wait for workers to exit when stopping.
+
+    Events:
+
+    - 'worker_start' (pid): A worker process has been forked.
+    - 'worker_exit' (pid, status): A worker process has exited. ``status``
+      is as returned by ``os.waitpid``.
+
+    :ivar workers: A dict of ``pid`` -> `gevent.event.AsyncResult` that will
+        hold the exit status of each running worker.
+    :ivar sockets: The list of listening sockets shared with the workers.
+    """
+
+    __slots__ = (
+        'workers',
+        'sockets',
+        '_exited',
+    )
+
+    def __init__(self, config=None, logger=None):
+        super(ProcessSupervisorService, self).__init__(config, logger=logger)
+
+        self.workers = {}
+        self.sockets = []
+        self._exited = queue.Queue()
+
+    def get_config_defaults(self):
+        return {
+            'workers': multiprocessing.cpu_count(),
+            'listen': [],
+            'listen_backlog': 128,
+            'respawn_delay': 1.0,
+            'kill_timeout': 10.0,
+        }
+
+    def make_worker_service(self, sockets):
+        """
+        Return the service that each worker process will run. This is called
+        in the worker process.
+
+        :param sockets: The list of listening sockets returned by
+            `make_sockets`.
+        """
+        raise NotImplementedError
+
+    def make_sockets(self):
+        """
+        Return a list of listening sockets that will be shared by all worker
+        processes. By default these are created from the ``listen`` config.
+        """
+        backlog = self.config['listen_backlog']
+
+        return [
+            make_listener(biloba_config.parse_address(address), backlog)
+            for address in self.config['listen']
+        ]
+
+    def do_start(self):
+        self.sockets = self.make_sockets()
+
+        for _ in range(self.config['workers']):
+            self.spawn_worker()
+
+        self.spawn(self.supervise)
+
+    def do_teardown(self):
+        self.stop_workers()
+
+    def do_stop(self):
+        for sock in self.sockets:
+            sock.close()
+
+        self.sockets = []
+
+    def spawn_worker(self):
+        """
+        Fork a new worker process.
+
+        :returns: The pid of the worker.
+        """
+        pid = gevent_os.fork_and_watch(callback=self._on_worker_exit)
+
+        if not pid:
+            # the worker process, this never returns
+            self.run_worker()
+
+        self.workers[pid] = event.AsyncResult()
+
+        self.logger.info('Started worker {}', pid)
+        self.emit('worker_start', pid)
+
+        return pid
+
+    def run_worker(self):
+        """
+        Run the worker service tree in a forked process and exit when it has
+        stopped.
+        """
+        status = 0
+
+        try:
+            worker = self.make_worker_service(self.sockets)
+
+            gevent.signal(signal.SIGTERM, worker.stop)
+            gevent.signal(signal.SIGINT, worker.stop)
+
+            worker.join()
+        except (Exception, BaseException):
+            status = 1
+
+            self.logger.exception('Worker {} failed', os.getpid())
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+            os._exit(status)
+
+    def supervise(self):
+        """
+        Wait for worker processes to exit and respawn them.
+        """
+        delay = self.config['respawn_delay']
+
+        while True:
+            pid, status = self._exited.get()
+
+            try:
+                # clean up the record of the child watcher
+                gevent_os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                pass
+
+            result = self.workers.pop(pid, None)
+
+            if result is not None:
+                result.set(status)
+
+            self.emit('worker_exit', pid, status)
+
+            if self._stopping:
+                continue
+
+            self.logger.warning(
+                'Worker {} exited (status:{}), respawning', pid, status
+            )
+
+            self.spawn(self.respawn_worker, delay)
+
+    def respawn_worker(self, delay):
+        gevent.sleep(delay)
+
+        if not self._stopping:
+            self.spawn_worker()
+
+    def stop_workers(self):
+        """
+        Ask all workers to stop and wait for them to exit. Workers that do not
+        exit within ``kill_timeout`` seconds are killed.
+        """
+        self.signal_workers(signal.SIGTERM)
+
+        results = self.workers.values()
+
+        gevent.joinall(results, timeout=self.config['kill_timeout'])
+
+        if not self.workers:
+            return
+
+        self.logger.warning('Killing {} worker(s)', len(self.workers))
+
+        self.signal_workers(signal.SIGKILL)
+
+        gevent.joinall(results)
+
+    def signal_workers(self, signum):
+        """
+        Send ``signum`` to all running workers.
+        """
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+
+    def _on_worker_exit(self, watcher):
+        # called from the hub, do not block
+        self._exited.put((watcher.pid, watcher.rstatus))
@@ -0,0 +1,309 @@
+"""
+A pool of worker processes for CPU bound work that can be waited on without
+blocking the gevent hub.
+"""
+
+import cPickle as pickle
+import errno
+import os
+import signal
+import struct
+import traceback
+
+import gevent
+from gevent import event, monkey, os as gevent_os, queue
+
+
+__all__ = [
+    'ProcessPool',
+    'ProcessPoolClosed',
+    'RemoteError',
+    'WorkerDied',
+]
+
+
+# the worker processes do not use gevent at all
+_raw_fork = monkey.get_original('os', 'fork')
+
+_header = struct.Struct('!I')
+
+
+class ProcessPoolClosed(RuntimeError):
+    """
+    Raised when submitting work to a pool that has been killed.
+    """
+
+
+class WorkerDied(RuntimeError):
+    """
+    Raised when the worker process exited while running the task.
+    """
+
+
+class RemoteError(RuntimeError):
+    """
+    Raised when the exception raised by the task could not be sent back from
+    the worker process.
+    """
+
+
+def read_exactly(fd, size, read):
+    data = ''
+
+    while len(data) < size:
+        chunk = read(fd, size - len(data))
+
+        if not chunk:
+            raise EOFError
+
+        data += chunk
+
+    return data
+
+
+def write_all(fd, data, write):
+    while data:
+        data = data[write(fd, data):]
+
+
+def recv(fd, read=os.read):
+    size, = _header.unpack(read_exactly(fd, _header.size, read))
+
+    return pickle.loads(read_exactly(fd, size, read))
+
+
+def send(fd, obj, write=os.write):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    write_all(fd, _header.pack(len(data)) + data, write)
+
+
+def run_worker(read_fd, write_fd):
+    """
+    The main loop of a worker process. Tasks are read from ``read_fd`` and the
+    results are written to ``write_fd`` until the pipe is closed.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            func, args, kwargs = recv(read_fd)
+        except EOFError:
+            return
+
+        try:
+            response = (True, func(*args, **kwargs))
+        except (Exception, BaseException) as exc:
+            response = (False, exc, traceback.format_exc())
+
+        try:
+            send(write_fd, response)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            send(write_fd, (False, RemoteError(repr(response[1])), ''))
+
+
+class Worker(object):
+    """
+    A handle on a single worker process.
+    """
+
+    __slots__ = (
+        'pid',
+        'read_fd',
+        'write_fd',
+        'exited',
+    )
+
+    def __init__(self, pid, read_fd, write_fd, exited):
+        self.pid = pid
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.exited = exited
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+
+class ProcessPool(object):
+    """
+    Maintains ``size`` forked worker processes that call the functions
+    submitted via `apply_async`. The function and its arguments (and the
+    result) must be picklable and the function must not use gevent.
+
+    Each worker is driven by a greenlet in this process that feeds it tasks
+    over a pipe, so waiting for a result never blocks the hub. A worker that
+    dies is replaced and the task it was running fails with `WorkerDied`.
+
+    :ivar size: The number of worker processes.
+    :ivar workers: A list of the running `Worker` processes.
+    :ivar restarts: The number of workers that have been replaced.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.workers = []
+        self.restarts = 0
+        self.closed = False
+
+        self._tasks = queue.Queue()
+        self._drivers = []
+
+    def start(self):
+        """
+        Fork the worker processes.
+        """
+        while len(self._drivers) < self.size:
+            self._drivers.append(gevent.spawn(self._drive))
+
+    def apply_async(self, func, args=(), kwargs=None):
+        """
+        Submit ``func(*args, **kwargs)`` to be called in a worker process.
+
+        :returns: A `gevent.event.AsyncResult` that will hold the result.
+        """
+        if self.closed:
+            raise ProcessPoolClosed('Process pool has been killed')
+
+        result = event.AsyncResult()
+
+        self._tasks.put((func, args, kwargs or {}, result))
+
+        return result
+
+    def apply(self, func, args=(), kwargs=None):
+        """
+        Call ``func(*args, **kwargs)`` in a worker process and wait for the
+        result.
+        """
+        return self.apply_async(func, args, kwargs).get()
+
+    def kill(self):
+        """
+        Kill all worker processes. Tasks that have not completed fail with
+        `ProcessPoolClosed`.
+        """
+        self.closed = True
+
+        gevent.killall(self._drivers)
+        self._drivers = []
+
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+
+            task[-1].set_exception(
+                ProcessPoolClosed('Process pool has been killed')
+            )
+
+    def _fork(self):
+        to_child = os.pipe()
+        from_child = os.pipe()
+        parent_fds = [
+            fd for worker in self.workers
+            for fd in (worker.read_fd, worker.write_fd)
+        ]
+        exited = event.AsyncResult()
+
+        pid = gevent_os.fork_and_watch(
+            callback=lambda watcher: exited.set(watcher.rstatus),
+            fork=_raw_fork,
+        )
+
+        if not pid:
+            # the worker process. make sure that it does not hold on to any
+            # of the pipes of the other workers
+            try:
+                for fd in parent_fds + [to_child[1], from_child[0]]:
+                    os.close(fd)
+
+                run_worker(to_child[0], from_child[1])
+            finally:
+                os._exit(0)
+
+        os.close(to_child[0])
+        os.close(from_child[1])
+
+        gevent_os.make_nonblocking(from_child[0])
+        gevent_os.make_nonblocking(to_child[1])
+
+        worker = Worker(pid, from_child[0], to_child[1], exited)
+
+        self.workers.append(worker)
+
+        return worker
+
+    def _drive(self):
+        while True:
+            worker = self._fork()
+
+            try:
+                self._feed(worker)
+            finally:
+                self.workers.remove(worker)
+                worker.close()
+
+            self.restarts += 1
+
+    def _feed(self, worker):
+        while True:
+            func, args, kwargs, result = self._tasks.get()
+
+            try:
+                response = self._call(worker, func, args, kwargs)
+            except gevent.GreenletExit:
+                result.set_exception(
+                    ProcessPoolClosed('Process pool has been killed')
+                )
+
+                raise
+            except (pickle.PicklingError, TypeError, AttributeError) as exc:
+                result.set_exception(exc)
+
+                continue
+
+            if response is None:
+                result.set_exception(WorkerDied(
+                    'Worker {} died while calling {!r}'.format(
+                        worker.pid, func
+                    )
+                ))
+
+                return
+
+            if response[0]:
+                result.set(response[1])
+
+                continue
+
+            exc, remote_traceback = response[1], response[2]
+
+            try:
+                exc.remote_traceback = remote_traceback
+            except AttributeError:
+                pass
+
+            result.set_exception(exc)
+
+    def _call(self, worker, func, args, kwargs):
+        """
+        Send the task to the worker and wait for the response. Returns `None`
+        if the worker has died.
+        """
+        try:
+            send(worker.write_fd, (func, args, kwargs), gevent_os.nb_write)
+
+            return recv(worker.read_fd, gevent_os.nb_read)
+        except (EOFError, OSError, IOError):
+            return None
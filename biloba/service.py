@@ -1,9 +1,241 @@
 import functools
+import multiprocessing
+import sys
+import time
+
 import gevent
-from gevent import event, pool
+from gevent import event, pool, queue, threadpool
 import logbook
 
-from biloba import config as biloba_config, events
+from biloba import config as biloba_config, events, pool as biloba_pool
+from biloba import limits, metrics as biloba_metrics, process, supervisor
+
+
+class ServiceStopping(RuntimeError):
+    """
+    Raised when attempting to spawn a greenlet on a service that is stopping.
+    """
+
+
+class TaskGroupTimeout(RuntimeError):
+    """
+    Raised when the greenlets in a `TaskGroup` do not complete before its
+    deadline.
+    """
+
+
+def call_and_catch(func, args, kwargs):
+    """
+    The same as `call_and_trap` except `gevent.GreenletExit` is raised, so the
+    greenlet calling ``func`` can still be killed.
+    """
+    try:
+        return True, func(*args, **kwargs)
+    except gevent.GreenletExit:
+        raise
+    except (Exception, BaseException):
+        return False, sys.exc_info()
+
+
+def call_and_trap(func, args, kwargs):
+    """
+    Call ``func`` and return a ``(success, value)`` tuple, where ``value`` is
+    the ``sys.exc_info()`` of the exception if ``success`` is `False`. Used to
+    pass exceptions raised in native threads back to the calling greenlet.
+    """
+    try:
+        return True, func(*args, **kwargs)
+    except (Exception, BaseException):
+        return False, sys.exc_info()
+
+
+class ServiceGreenlet(gevent.Greenlet):
+    """
+    A greenlet spawned by a service (see `Service.spawn`). An exception raised
+    by the greenlet is emitted as an 'error' event by the service and the
+    greenlet completes successfully with a value of `None`. If handling the
+    exception fails, the greenlet fails with the original exception.
+
+    :ivar service: The service that spawned this greenlet.
+    """
+
+    def __init__(self, service, run, *args, **kwargs):
+        gevent.Greenlet.__init__(self, run, *args, **kwargs)
+
+        self.service = service
+
+    def _report_error(self, exc_info):
+        if isinstance(exc_info[1], gevent.GreenletExit):
+            gevent.Greenlet._report_error(self, exc_info)
+
+            return
+
+        try:
+            try:
+                self.service.handle_exception(exc_info)
+            except (Exception, BaseException):
+                # the greenlet must always complete, fail it with the original
+                # exception
+                gevent.Greenlet._report_error(self, exc_info)
+
+                return
+        finally:
+            del exc_info
+
+        self._report_result(None)
+
+
+class TaskGroup(object):
+    """
+    Spawns greenlets in a service and waits for all of them to complete when
+    the ``with`` block exits (see `Service.task_group`)::
+
+        with my_service.task_group(timeout=5) as group:
+            for url in urls:
+                group.spawn(fetch, url)
+
+        pages = group.results
+
+    If a greenlet raises, the other greenlets in the group are killed and the
+    exception is raised when the block exits (it is not emitted as an 'error'
+    event). If the greenlets have not completed ``timeout`` seconds after the
+    group was created, they are killed and `TaskGroupTimeout` is raised. No
+    greenlet spawned by the group outlives the ``with`` block.
+
+    :ivar greenlets: The spawned greenlets.
+    :ivar results: The values returned by the greenlets, in the order they
+        were spawned. Set when the block exits successfully.
+    """
+
+    __slots__ = (
+        'service',
+        'greenlets',
+        'results',
+        '_deadline',
+        '_failure',
+        '_running',
+        '_done',
+        '_closed',
+    )
+
+    def __init__(self, service, timeout=None):
+        self.service = service
+        self.greenlets = []
+        self.results = None
+
+        self._deadline = None
+        self._failure = None
+        self._running = 0
+        self._done = event.Event()
+        self._closed = False
+
+        if timeout is not None:
+            self._deadline = time.time() + timeout
+
+        self._done.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._closed = True
+
+        if exc_type is not None:
+            self.kill()
+
+            return False
+
+        self.join()
+
+    def spawn(self, func, *args, **kwargs):
+        """
+        Spawn ``func(*args, **kwargs)`` in the pool of the service.
+
+        :returns: The spawned greenlet, its value is the value returned by
+            ``func``.
+        """
+        if self._closed:
+            raise RuntimeError(
+                'Cannot spawn {!r}, task group is closed'.format(func)
+            )
+
+        thread = self.service.spawn(self._call, func, args, kwargs)
+
+        self.greenlets.append(thread)
+        self._running += 1
+        self._done.clear()
+
+        thread.rawlink(self._finished)
+
+        return thread
+
+    def join(self):
+        """
+        Wait for all the greenlets to complete and set `results`, see the
+        class docstring.
+        """
+        timeout = None
+
+        if self._deadline is not None:
+            timeout = max(0, self._deadline - time.time())
+
+        self._done.wait(timeout)
+
+        if self._failure is not None:
+            self.kill()
+
+            exc_info, self._failure = self._failure, None
+
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        if not self._done.is_set():
+            self.kill()
+
+            raise TaskGroupTimeout(
+                '{} task(s) did not complete in time'.format(self._running)
+            )
+
+        results = [thread.value for thread in self.greenlets]
+
+        for result in results:
+            if isinstance(result, gevent.GreenletExit):
+                raise ServiceStopping(
+                    '{!r} stopped while the task group was running'.format(
+                        self.service
+                    )
+                )
+
+        self.results = results
+
+    def kill(self):
+        """
+        Kill all the greenlets in this group and wait for them to exit.
+        """
+        gevent.killall(self.greenlets)
+        gevent.joinall(self.greenlets)
+
+    def _call(self, func, args, kwargs):
+        success, value = call_and_catch(func, args, kwargs)
+
+        if success:
+            return value
+
+        if self._failure is None:
+            self._failure = value
+            self._done.set()
+
+            # cancel the siblings
+            current = gevent.getcurrent()
+
+            for thread in self.greenlets:
+                if thread is not current:
+                    thread.kill(block=False)
+
+    def _finished(self, thread):
+        self._running -= 1
+
+        if not self._running:
+            self._done.set()
 
 
 class Service(events.EventEmitter):
@@ -16,7 +248,8 @@ class Service(events.EventEmitter):
 
     There is a distinction between arbitrary greenlets and 'service' greenlets.
     A service greenlet is meant to run forever, if for some reason it dies
-    early then all other services are torn down as this parent service is done.
+    early then all other services are torn down as this parent service is done
+    (unless the child service has a restart policy, see `add_service`).
 
     All greenlets that are spawned by this service are specially managed. If
     the greenlet throws an exception, the 'error' event will be emitted by this
@@ -27,9 +260,15 @@ class Service(events.EventEmitter):
     :ivar services: A list of child service objects that this service is
         watching.
     :ivar pool: A thread pool controlled by this service. If the threadpool
-        empties, this service is dead.
+        empties, this service is dead. See `make_pool`.
     :ivar logger: The logbook instance that is used by the service to log
         interesting events.
+    :ivar metrics: The `biloba.metrics.ServiceMetrics` of this service. See
+        `stats`.
+    :ivar rate_limiter: The `biloba.limits.RateLimiter` that `spawn` acquires
+        from if the ``rate_limit`` option is set.
+    :ivar error_coalescer: The `biloba.events.ErrorCoalescer` that exceptions
+        are logged through if the ``error_coalesce_window`` option is set.
     """
 
     __slots__ = (
@@ -39,24 +278,169 @@ class Service(events.EventEmitter):
         'logger',
         '_run_thread',
         '_kill',
+        '_kill_deadline',
+        '_dependencies',
+        '_restart_policies',
+        '_error_subscriptions',
+        '_stopping',
+        '_draining',
+        '_links',
+        '_restarts',
+        '_threadpool',
+        '_thread_calls',
+        '_thread_active',
+        '_process_pool',
+        'metrics',
+        'rate_limiter',
+        '_rate_limiters',
+        'error_coalescer',
     )
 
     # set to specify the logger name (before the first access)
     logger_name = None
 
+    # the maximum number of greenlets that can be spawned concurrently by this
+    # service. `None` means unbounded.
+    pool_size = None
+    # what `spawn` does when the pool is full, one of 'block', 'fail' or
+    # 'queue'. See `biloba.pool.BoundedPool`.
+    pool_policy = biloba_pool.BLOCK
+    # the maximum number of spawned greenlets waiting for a slot when
+    # `pool_policy` is 'queue'.
+    pool_backlog = 0
+    # start child services concurrently, respecting any declared
+    # dependencies. If `False` children are started one after the other in
+    # the order that they were added.
+    concurrent_start = True
+    # stop child services concurrently. A child is only stopped once all of
+    # the services that depend on it have stopped. If `False` children are
+    # stopped one after the other in the order that they were added.
+    concurrent_stop = True
+    # the maximum number of seconds that tearing down this service may take.
+    # Child services and greenlets that are still running after this deadline
+    # are killed. `None` means wait forever.
+    stop_timeout = None
+    # the number of seconds that child services killed because they did not
+    # stop before `stop_timeout` are given to exit. See `kill`.
+    kill_timeout = 1.0
+    # the number of seconds that greenlets spawned by this service are given
+    # to finish when it is stopped, before they are killed. `None` means that
+    # they are killed immediately.
+    drain_timeout = None
+    # the maximum number of native threads used by `run_in_thread` and
+    # `spawn_blocking`. `None` means that the threadpool of the hub is shared.
+    threadpool_size = None
+    # the number of worker processes used by `run_in_process` and
+    # `spawn_process`. `None` means one per cpu.
+    process_pool_size = None
+    # the default maximum number of greenlets that `map`, `imap` and
+    # `imap_unordered` have in flight.
+    map_concurrency = 100
+    # the target number of seconds that greenlets spawned by this service take
+    # to complete. If set, the number of concurrent greenlets is adapted to
+    # meet the target. See `biloba.pool.AdaptivePool`.
+    adaptive_latency = None
+    # the number of greenlets per second that `spawn` may start while this
+    # service is running. `None` means unlimited. See `make_rate_limiter`.
+    rate_limit = None
+    # the number of greenlets that `spawn` may start in a burst, defaults to
+    # ``rate_limit``.
+    rate_burst = None
+    # if set, identical exceptions logged by this service within this number
+    # of seconds are coalesced in to a summary. See
+    # `biloba.events.ErrorCoalescer`.
+    error_coalesce_window = None
+    # the number of tracebacks of each exception that are logged per window.
+    error_coalesce_samples = 1
+
     def __init__(self, logger=None):
         super(Service, self).__init__()
 
         self.started = False
         self.services = []
-        self.pool = pool.Group()
+        self.pool = self.make_pool()
         self.logger = logger or self.get_logger()
         self._run_thread = None
         self._kill = event.Event()
+        self._kill_deadline = None
+        self._dependencies = {}
+        self._restart_policies = {}
+        self._error_subscriptions = {}
+        self._stopping = False
+        self._draining = False
+        self._links = []
+        self._restarts = set()
+        self._threadpool = None
+        self._thread_calls = 0
+        self._thread_active = 0
+        self._process_pool = None
+        self.metrics = biloba_metrics.ServiceMetrics()
+        self._rate_limiters = []
+        self.rate_limiter = None
+
+        self.error_coalescer = None
+
+        window = self.get_option('error_coalesce_window')
+
+        if window is not None:
+            self.error_coalescer = events.ErrorCoalescer(
+                self,
+                window=window,
+                samples=self.get_option('error_coalesce_samples'),
+            )
+
+        rate = self.get_option('rate_limit')
+
+        if rate is not None:
+            self.rate_limiter = self.make_rate_limiter(
+                rate, burst=self.get_option('rate_burst')
+            )
 
     def get_logger(self):
         return logbook.Logger(self.logger_name or self.__class__.__name__)
 
+    def get_option(self, name):
+        """
+        Return the value of the tunable option ``name`` for this service. By
+        default this is the class attribute of the same name.
+        """
+        return getattr(self, name)
+
+    def make_dispatcher(self):
+        """
+        Return the `biloba.events.AsyncDispatcher` used by `emit_async`,
+        configured by the ``emit_buffer_size`` and ``emit_overflow`` options
+        (see `biloba.events.EventEmitter`).
+        """
+        return events.AsyncDispatcher(
+            self,
+            size=self.get_option('emit_buffer_size'),
+            overflow=self.get_option('emit_overflow'),
+        )
+
+    def make_pool(self):
+        """
+        Return the greenlet pool that will be used by `spawn`. If the
+        ``pool_size`` option is set, the pool is bounded and applies
+        backpressure according to ``pool_policy``. If ``adaptive_latency`` is
+        set, the pool is a `biloba.pool.AdaptivePool` (bounded by
+        ``pool_size``).
+        """
+        size = self.get_option('pool_size')
+        latency = self.get_option('adaptive_latency')
+
+        if latency is not None:
+            return biloba_pool.AdaptivePool(latency, max_size=size)
+
+        if size is None:
+            return pool.Group()
+
+        return biloba_pool.BoundedPool(
+            size,
+            policy=self.get_option('pool_policy'),
+            backlog=self.get_option('pool_backlog'),
+        )
+
     def do_start(self):
         """
         Called when this service is starting but before it is actually running.
@@ -91,22 +475,16 @@ class Service(events.EventEmitter):
             return
 
         self._kill.clear()
+        self._kill_deadline = None
 
         if not self._run_thread:
-            # Finish service if everything in the pool is done.
-            def finish():
-                self.pool.join()
-
-                if not self._kill.is_set():
-                    self._kill.set()
-
             # there is no running thread, let's start it
             def run():
                 with self.emit_exceptions(propagate=False):
                     try:
                         self.start_service()
 
-                        gevent.spawn(finish)
+                        gevent.spawn(self.finish)
 
                         self._kill.wait()
                     finally:
@@ -115,10 +493,18 @@ class Service(events.EventEmitter):
             self._run_thread = gevent.spawn(run)
 
             # ensure that the _run_thread attribute is cleaned up when the
-            # greenlet comes to an end
+            # greenlet comes to an end and notify anything that is linked
             def cleanup(g):
                 self._run_thread = None
 
+                for callback in list(self._links):
+                    try:
+                        callback(self)
+                    except (Exception, BaseException):
+                        self.logger.exception(
+                            'Error calling link {!r}', callback
+                        )
+
             self._run_thread.rawlink(cleanup)
 
         if not block:
@@ -127,38 +513,98 @@ class Service(events.EventEmitter):
         # block this greenlet until the run thread starts the service
         result = gevent.event.AsyncResult()
 
-        @self.once('error')
         def on_error(*exc_info):
-            self.remove_listener('start', on_start)
+            start_subscription.cancel()
 
             result.set(exc_info)
 
-        @self.once('start')
         def on_start():
-            self.remove_listener('error', on_error)
+            error_subscription.cancel()
 
             result.set()
 
+        error_subscription = self.subscribe('error', on_error, once=True)
+        start_subscription = self.subscribe('start', on_start, once=True)
+
         exc_info = result.get()
 
         if exc_info:
             raise exc_info[0], exc_info[1], exc_info[2]
 
+    def is_running(self):
+        """
+        Whether this service has been started and has not yet stopped.
+        """
+        return bool(self.started or self._run_thread)
+
+    def rawlink(self, callback):
+        """
+        Register ``callback`` to be called with this service as its only
+        argument whenever this service stops running.
+
+        Callbacks are called from the hub and so must not block.
+        """
+        self._links.append(callback)
+
+    def unlink(self, callback):
+        """
+        Remove a callback registered with `rawlink`.
+        """
+        try:
+            self._links.remove(callback)
+        except ValueError:
+            pass
+
+    def finish(self):
+        """
+        Wait for all the greenlets in the pool to complete, then if there are
+        no child services running this service is done.
+        """
+        self.pool.join()
+
+        self.check_finished()
+
+    def check_finished(self):
+        """
+        Stop this service if it has nothing left to do, i.e. there are no
+        greenlets in the pool, no child services running and no child services
+        waiting to be restarted.
+        """
+        if self._kill.is_set() or self._restarts:
+            return
+
+        for child in self.services:
+            if child.is_running():
+                return
+
+        if self.pool:
+            # wait for the pool to empty again
+            gevent.spawn(self.finish)
+
+            return
+
+        self._kill.set()
+
     def stop(self, block=True):
         """
         Called to stop this service if it is running. All child services are
         `stopped` and any greenlets this service may have spawned are killed.
 
         Any custom code should generally go in to `do_stop`.
+
+        A service that is still starting will be stopped as soon as it has
+        started.
         """
-        if not self.started:
+        run_thread = self._run_thread
+
+        if not self.started and not run_thread:
             return
 
         self._kill.set()
 
-        if block:
+        if block and run_thread and run_thread is not gevent.getcurrent():
             try:
-                self._run_thread.get()
+                run_thread.get()
             except gevent.GreenletExit:
                 pass
 
@@ -167,14 +613,20 @@ class Service(events.EventEmitter):
         Called in the running service thread to start the service. This method
         blocks until all the child services have started.
         """
+        started_at = time.time()
+
+        for limiter in self._rate_limiters:
+            limiter.start()
+
         self.do_start()
 
-        for child in self.services:
-            child.start(block=True)
+        self.start_children()
 
-            self.spawn(self.watch_service, child)
+        for child in self.services:
+            self.watch_service(child)
 
         self.started = True
+        self.metrics.start_duration = time.time() - started_at
 
         try:
             self.emit('start')
@@ -183,7 +635,75 @@ class Service(events.EventEmitter):
 
             raise
 
+    def start_children(self):
+        """
+        Start all child services and block until they have started.
+
+        Children that do not depend on each other are started concurrently and
+        a child is started as soon as all of the services it depends on have
+        started (see `add_service`). If any child fails to start, the children
+        that are still starting are abandoned and the exception is raised.
+        """
+        if not self.get_option('concurrent_start'):
+            for child in self.services:
+                child.start(block=True)
+
+            return
+
+        if not self.services:
+            return
+
+        started = {}
+        failures = []
+        finished = event.Event()
+        remaining = [len(self.services)]
+
+        def start_child(child, dependencies):
+            try:
+                for dependency in dependencies:
+                    dependency.wait()
+
+                child.start(block=True)
+            except gevent.GreenletExit:
+                raise
+            except (Exception, BaseException):
+                failures.append(sys.exc_info())
+                finished.set()
+
+                return
+
+            started[child].set()
+            remaining[0] -= 1
+
+            if not remaining[0]:
+                finished.set()
+
+        threads = []
+
+        # services can only depend on services that were added before them so
+        # the list is already in dependency order.
+        for child in self.services:
+            dependencies = [
+                started[dependency]
+                for dependency in self._dependencies.get(child, ())
+            ]
+
+            started[child] = event.Event()
+            threads.append(gevent.spawn(start_child, child, dependencies))
+
+        try:
+            finished.wait()
+        finally:
+            gevent.killall(threads)
+
+        if failures:
+            exc_info = failures[0]
+
+            raise exc_info[0], exc_info[1], exc_info[2]
+
     def stop_service(self):
+        stopped_at = time.time()
+
         try:
             self.teardown_service()
         finally:
@@ -191,6 +711,9 @@ class Service(events.EventEmitter):
                 self.do_stop()
             finally:
                 self.started = False
+                self._stopping = False
+                self._draining = False
+                self.metrics.stop_duration = time.time() - stopped_at
 
                 # it is important that everything is torn down before the
                 # event is emitted
@@ -202,14 +725,206 @@ class Service(events.EventEmitter):
 
         This is generally an internally called method, use with care.
         """
+        self._stopping = True
+
+        timeout = self.get_option('stop_timeout')
+        drain_timeout = self.get_option('drain_timeout')
+        deadline = None
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        if self._kill_deadline is not None:
+            # this service has been killed, see `kill`
+            deadline = min(
+                deadline or self._kill_deadline, self._kill_deadline
+            )
+
+        if deadline is not None and drain_timeout is not None:
+            drain_timeout = min(drain_timeout, max(0, deadline - time.time()))
+
         try:
-            self.do_teardown()
+            if deadline is None:
+                self.do_teardown()
+            else:
+                with gevent.Timeout(max(0, deadline - time.time()), False):
+                    self.do_teardown()
         finally:
-            for service in self.services:
-                service.stop()
+            try:
+                if drain_timeout is not None:
+                    if deadline is not None:
+                        drain_timeout = min(
+                            drain_timeout, max(0, deadline - time.time())
+                        )
 
-            self.services = []
-            self.pool.kill()
+                    # the greenlets that are draining must not spawn more
+                    self._draining = True
+
+                    self.drain(drain_timeout)
+            finally:
+                try:
+                    self.stop_children(deadline=deadline)
+                finally:
+                    for child in self.services:
+                        child.unlink(self.handle_service_exit)
+
+                    for subscription in self._error_subscriptions.values():
+                        subscription.cancel()
+
+                    self.services = []
+                    self._dependencies = {}
+                    self._restart_policies = {}
+                    self._error_subscriptions = {}
+
+                    if deadline is not None:
+                        timeout = max(0, deadline - time.time())
+
+                    self.pool.kill(timeout=timeout)
+
+                    gevent.killall(list(self._restarts), timeout=timeout)
+
+                    if self._threadpool is not None:
+                        self._threadpool.kill()
+                        self._threadpool = None
+
+                    if self._process_pool is not None:
+                        self._process_pool.kill()
+                        self._process_pool = None
+
+                    for limiter in self._rate_limiters:
+                        limiter.stop()
+
+                    if self.error_coalescer is not None:
+                        self.error_coalescer.flush()
+
+    def drain(self, timeout=None):
+        """
+        Wait for the greenlets spawned by this service to finish and kill any
+        that are still running after ``timeout`` seconds.
+
+        Emits a 'drain' event with the number of greenlets that finished and
+        the number that were killed.
+
+        :returns: A ``(drained, killed)`` tuple.
+        """
+        greenlets = list(self.pool)
+        # greenlets that are queued in a bounded pool will be started as
+        # running greenlets finish
+        greenlets.extend(getattr(self.pool, 'backlog', ()))
+
+        gevent.joinall(greenlets, timeout=timeout)
+
+        pending = [thread for thread in greenlets if not thread.ready()]
+
+        if pending:
+            gevent.killall(pending, block=False)
+
+        drained = len(greenlets) - len(pending)
+        killed = len(pending)
+
+        self.logger.info(
+            'Drained {} greenlet(s), killed {} greenlet(s)', drained, killed
+        )
+
+        self.emit('drain', drained, killed)
+
+        return drained, killed
+
+    def stop_children(self, deadline=None):
+        """
+        Stop all child services and block until they have stopped.
+
+        Children are stopped concurrently in reverse dependency order, i.e. a
+        child is stopped as soon as all of the services that depend on it have
+        stopped. Exceptions raised while stopping a child are emitted as
+        'error' events.
+
+        :param deadline: The time (as returned by `time.time`) by which all
+            children must have stopped. Any child still running after the
+            deadline is killed (see `kill`).
+        """
+        if not self.services:
+            return
+
+        waiting_on = {}
+
+        if self.get_option('concurrent_stop'):
+            for child, dependencies in self._dependencies.items():
+                for dependency in dependencies:
+                    waiting_on.setdefault(dependency, []).append(child)
+        else:
+            for previous, child in zip(self.services, self.services[1:]):
+                waiting_on[child] = [previous]
+
+        def stop_child(child, threads):
+            gevent.joinall(threads)
+
+            with self.emit_exceptions(propagate=False):
+                child.stop()
+
+        threads = {}
+        ordered = self.services
+
+        if self.get_option('concurrent_stop'):
+            # dependents are always added after their dependencies
+            ordered = reversed(ordered)
+
+        for child in ordered:
+            threads[child] = gevent.spawn(stop_child, child, [
+                threads[other] for other in waiting_on.get(child, ())
+            ])
+
+        timeout = None
+
+        if deadline is not None:
+            timeout = max(0, deadline - time.time())
+
+        killed = []
+
+        try:
+            gevent.joinall(threads.values(), timeout=timeout)
+        finally:
+            for child, thread in threads.items():
+                if thread.ready():
+                    continue
+
+                thread.kill(block=False)
+                child.kill()
+
+                killed.append(child)
+
+        if not killed:
+            return
+
+        self.logger.warning(
+            'Killed {} child service(s) that did not stop in time: {!r}',
+            len(killed),
+            killed,
+        )
+
+        # the teardown of a killed service does not wait (see `kill`), make
+        # sure that the children have exited before this service stops
+        gevent.joinall(
+            [
+                child._run_thread for child in killed
+                if isinstance(child, Service) and child._run_thread
+            ],
+            timeout=self.get_option('kill_timeout'),
+        )
+
+    def kill(self, block=False):
+        """
+        Forcibly stop this service by killing the greenlet that is running it.
+        Unlike `stop`, this does not wait for an orderly teardown:
+        `do_teardown` is interrupted as soon as it blocks and child services
+        and greenlets are killed immediately.
+        """
+        run_thread = self._run_thread
+
+        if run_thread:
+            self._kill_deadline = time.time()
+
+            run_thread.kill(block=block)
 
     def join(self):
         """
@@ -223,6 +938,17 @@ class Service(events.EventEmitter):
         finally:
             self.stop()
 
+    def on_child_error(self, child, *exc_info):
+        """
+        Called when a child service emits an 'error' event.
+        """
+        policy = self._restart_policies.get(child)
+
+        if policy is not None:
+            policy.failed = True
+
+        self.handle_service_error(child, *exc_info)
+
     def handle_service_error(self, service, *exc_info):
         """
         Called when a service that this parent is watching emits an 'error'
@@ -236,17 +962,47 @@ class Service(events.EventEmitter):
         """
         self.emit('error', *exc_info)
 
-    def add_service(self, *services):
+    def add_service(self, *services, **kwargs):
         """
         Add a service to this parent service object. A service must only have
         one parent.
+
+        By default, when a child service returns this service is stopped. A
+        restart policy changes that, see `biloba.supervisor.RestartPolicy`.
+
+        :param depends_on: A list of services (already added to this service)
+            that must be started before ``services`` are started.
+        :param restart: One of 'permanent', 'transient' or 'temporary' or a
+            `biloba.supervisor.RestartPolicy` instance.
         """
+        depends_on = tuple(kwargs.pop('depends_on', ()))
+        restart = kwargs.pop('restart', None)
+
+        if kwargs:
+            raise TypeError(
+                'Unexpected keyword arguments {!r}'.format(kwargs.keys())
+            )
+
+        for dependency in depends_on:
+            if dependency not in self.services:
+                raise ValueError(
+                    'Unknown dependency {!r}, it must be added to this '
+                    'service first'.format(dependency)
+                )
+
         for child in services:
+            if depends_on:
+                self._dependencies[child] = depends_on
+
+            if restart is not None:
+                self._restart_policies[child] = supervisor.make_policy(restart)
+
             # push all child errors in to the error handling mechanism of this
-            # service
-            child.on(
+            # service. Weakly, so a child does not keep its parent alive.
+            self._error_subscriptions[child] = child.subscribe(
                 'error',
-                lambda *exc_info: self.handle_service_error(child, *exc_info)
+                functools.partial(self.on_child_error, child),
+                weak=True,
             )
 
         self.services.extend(services)
@@ -255,7 +1011,66 @@ class Service(events.EventEmitter):
             return
 
         for child in services:
-            self.spawn(self.watch_service, child)
+            child.start(block=False)
+
+            self.watch_service(child)
+
+    def emit(self, event, *args, **kwargs):
+        if event == 'error':
+            self.metrics.errors += 1
+
+        return super(Service, self).emit(event, *args, **kwargs)
+
+    def stats(self):
+        """
+        Return a snapshot of the runtime metrics of this service and all of
+        its child services, as a dict:
+
+        - ``service``: The name of the service class.
+        - ``started``: Whether the service is started.
+        - ``live``: The number of greenlets running in the pool.
+        - ``spawned``: The total number of greenlets spawned.
+        - ``spawn_rate``: Greenlets spawned per second (decaying average).
+        - ``errors``: The number of 'error' events emitted (including those
+          forwarded from child services).
+        - ``start_duration``/``stop_duration``: How many seconds the last
+          start/stop took, or `None`.
+        - ``children``: The number of child services.
+        - ``limit``: The current maximum number of concurrent greenlets or
+          `None` if unbounded.
+        - ``dispatcher``: The stats of the queue of `emit_async` (see
+          `biloba.events.AsyncDispatcher.stats`) or `None` if it is unused.
+        - ``services``: A list of the snapshots of the child services.
+        - ``total``: ``live``, ``spawned``, ``spawn_rate`` and ``children``
+          summed over this service and all of its descendants.
+        """
+        metrics = self.metrics
+        children = [
+            child.stats() for child in self.services
+            if isinstance(child, Service)
+        ]
+
+        snapshot = {
+            'service': self.__class__.__name__,
+            'started': self.started,
+            'live': len(self.pool),
+            'spawned': metrics.spawned,
+            'spawn_rate': metrics.spawn_rate.rate(),
+            'errors': metrics.errors,
+            'start_duration': metrics.start_duration,
+            'stop_duration': metrics.stop_duration,
+            'children': len(self.services),
+            'limit': getattr(self.pool, 'size', None),
+            'dispatcher': (
+                self._dispatcher.stats()
+                if self._dispatcher is not None else None
+            ),
+            'services': children,
+        }
+
+        snapshot['total'] = biloba_metrics.aggregate(snapshot, children)
+
+        return snapshot
 
     def emit_exceptions(self, propagate=True, always_log=False, emit=True):
         """
@@ -274,8 +1089,32 @@ class Service(events.EventEmitter):
             always_log=always_log,
             emit=emit,
             skip_types=(gevent.GreenletExit,),
+            coalescer=self.error_coalescer,
+        )
+
+    def handle_exception(self, exc_info, always_log=False):
+        """
+        Emit an exception trapped outside of `emit_exceptions` as an 'error'
+        event, logging it if it is not handled.
+
+        :param exc_info: The exception as returned by ``sys.exc_info()``.
+        """
+        events.handle_exception(
+            self,
+            self.logger,
+            exc_info,
+            always_log=always_log,
+            skip_types=(gevent.GreenletExit,),
+            coalescer=self.error_coalescer,
         )
 
+    def handle_dispatch_error(self, exc_info):
+        """
+        Exceptions raised by listeners of events queued by `emit_async` are
+        handled like any other trapped exception (see `handle_exception`).
+        """
+        self.handle_exception(exc_info)
+
     def spawn(self, func, *args, **kwargs):
         """
         Spawns a greenlet that is linked to this service and will be killed if
@@ -284,35 +1123,427 @@ class Service(events.EventEmitter):
         :param func: The callable to execute in a new greenlet context.
         :param args: The args to pass to the callable.
         :param kwargs: The kwargs to pass to the callable.
-        :returns: The spawned greenlet thread.
+        :returns: The spawned `ServiceGreenlet`. If the ``rate_limit`` option
+            is set, this blocks until `rate_limiter` allows the greenlet.
+        :raises biloba.pool.PoolFull: If the pool is bounded and cannot accept
+            the greenlet.
+        :raises ServiceStopping: If this service is draining its greenlets
+            while it stops (see ``drain_timeout``).
         """
-        @functools.wraps(func)
-        def wrapped():
-            with self.emit_exceptions(propagate=False):
-                return func(*args, **kwargs)
+        if self._draining:
+            raise ServiceStopping(
+                'Cannot spawn {!r}, {!r} is stopping'.format(func, self)
+            )
 
-        return self.pool.spawn(wrapped)
+        # the limit only applies while the service is running, nothing would
+        # wake up a greenlet waiting for tokens otherwise
+        if self.rate_limiter is not None and self.rate_limiter.started:
+            self.rate_limiter.acquire()
 
-    def watch_service(self, child):
+        thread = ServiceGreenlet(self, func, *args, **kwargs)
+
+        self.pool.start(thread)
+        self.metrics.spawn()
+
+        return thread
+
+    def make_rate_limiter(self, rate, burst=None, **kwargs):
+        """
+        Return a `biloba.limits.RateLimiter` that allows ``rate`` acquisitions
+        per second (per key) in bursts of up to ``burst``. The refill timer of
+        the limiter runs while this service is running.
+
+        Any greenlet can acquire from the limiter, e.g.::
+
+            limiter = self.make_rate_limiter(10, burst=20)
+
+            def call_partner(partner, request):
+                limiter.acquire(partner)
+
+                ...
+        """
+        limiter = limits.RateLimiter(rate, burst=burst, **kwargs)
+
+        self._rate_limiters.append(limiter)
+
+        if self.is_running():
+            limiter.start()
+
+        return limiter
+
+    def get_threadpool(self):
+        """
+        Return the native threadpool used by `run_in_thread`. If the
+        ``threadpool_size`` option is set, the threadpool is created on first
+        use and killed when this service is stopped.
         """
-        Watch a child service and if it returns, this service is done.
+        if self._threadpool is not None:
+            return self._threadpool
+
+        size = self.get_option('threadpool_size')
+
+        if size is None:
+            return gevent.get_hub().threadpool
+
+        self._threadpool = threadpool.ThreadPool(size)
+
+        return self._threadpool
+
+    def run_in_thread(self, func, *args, **kwargs):
         """
+        Call ``func`` in a native thread, blocking the current greenlet (but
+        not the hub) until it returns. Use this for blocking calls that do not
+        cooperate with gevent, e.g. C libraries.
+
+        :returns: The value returned by ``func``. Any exception it raises is
+            raised in the calling greenlet.
+        """
+        threads = self.get_threadpool()
+
+        self._thread_calls += 1
+        self._thread_active += 1
+
         try:
-            child.join()
+            result = threads.spawn(call_and_trap, func, args, kwargs)
+            success, value = result.get()
         finally:
-            if not self._kill.is_set():
-                self._kill.set()
+            self._thread_active -= 1
+
+        if not success:
+            raise value[0], value[1], value[2]
+
+        return value
+
+    def spawn_blocking(self, func, *args, **kwargs):
+        """
+        The same as `spawn` except ``func`` is called in a native thread (see
+        `run_in_thread`). An exception raised by ``func`` is emitted as an
+        'error' event by this service.
+
+        :returns: The spawned greenlet, its value is the value returned by
+            ``func``.
+        """
+        return self.spawn(self.run_in_thread, func, *args, **kwargs)
+
+    def threadpool_stats(self):
+        """
+        Return a dict of statistics about the use of native threads by this
+        service.
+        """
+        threads = self.get_threadpool()
+        active = self._thread_active
+        utilisation = 0.0
+
+        if threads.maxsize:
+            utilisation = float(active) / threads.maxsize
+
+        return {
+            'threads': threads.size,
+            'maxsize': threads.maxsize,
+            'active': active,
+            'calls': self._thread_calls,
+            'completed': self._thread_calls - active,
+            'utilisation': utilisation,
+        }
+
+    def get_process_pool(self):
+        """
+        Return the `biloba.process.ProcessPool` used by `run_in_process`. The
+        worker processes are forked on first use and killed when this service
+        is stopped.
+        """
+        if self._process_pool is not None:
+            return self._process_pool
+
+        size = self.get_option('process_pool_size')
+
+        if size is None:
+            size = multiprocessing.cpu_count()
+
+        self._process_pool = process.ProcessPool(size)
+        self._process_pool.start()
+
+        return self._process_pool
+
+    def run_in_process(self, func, *args, **kwargs):
+        """
+        Call ``func`` in a worker process, blocking the current greenlet (but
+        not the hub) until it returns. Use this for CPU bound work. ``func``,
+        its arguments and its return value must be picklable.
+
+        :returns: The value returned by ``func``. Any exception it raises is
+            raised in the calling greenlet.
+        """
+        return self.get_process_pool().apply(func, args, kwargs)
+
+    def spawn_process(self, func, *args, **kwargs):
+        """
+        The same as `spawn` except ``func`` is called in a worker process (see
+        `run_in_process`). An exception raised by ``func`` is emitted as an
+        'error' event by this service.
+
+        :returns: The spawned greenlet, its value is the value returned by
+            ``func``.
+        """
+        return self.spawn(self.run_in_process, func, *args, **kwargs)
+
+    def task_group(self, timeout=None):
+        """
+        Return a `TaskGroup` that spawns greenlets in this service, gathers
+        their results and cancels them all if one fails or they take longer
+        than ``timeout`` seconds.
+        """
+        return TaskGroup(self, timeout=timeout)
+
+    def imap_unordered(self, func, iterable, concurrency=None):
+        """
+        Call ``func(item)`` for each item in ``iterable`` in greenlets spawned
+        by this service and yield the results as they complete.
+
+        The items are consumed lazily and at most ``concurrency`` (defaults to
+        the ``map_concurrency`` option) greenlets are in flight at any time.
+        If ``func`` raises, the exception is raised by the iterator. When the
+        iterator raises or is closed, the greenlets still in flight are
+        killed. If the service stops, `ServiceStopping` is raised.
+        """
+        return self._map(func, iterable, concurrency, ordered=False)
+
+    def imap(self, func, iterable, concurrency=None):
+        """
+        The same as `imap_unordered` except the results are yielded in the
+        order of ``iterable``. Results that complete early are buffered and
+        count towards ``concurrency``.
+        """
+        return self._map(func, iterable, concurrency, ordered=True)
+
+    def map(self, func, iterable, concurrency=None):
+        """
+        The same as `imap` except a list of the results is returned once all
+        are complete.
+        """
+        return list(self.imap(func, iterable, concurrency))
+
+    def _map(self, func, iterable, concurrency, ordered):
+        if concurrency is None:
+            concurrency = self.get_option('map_concurrency')
+
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        items = enumerate(iterable)
+        done = queue.Queue()
+        # greenlet -> index of the item, until its result is received
+        pending = {}
+        # results waiting for an earlier result when ``ordered``
+        buffered = {}
+        next_index = 0
+        exhausted = [False]
+
+        def fill():
+            while not exhausted[0]:
+                if len(pending) + len(buffered) >= concurrency:
+                    return
+
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    exhausted[0] = True
+
+                    return
+
+                thread = self.spawn(call_and_catch, func, (item,), {})
+
+                pending[thread] = index
+                thread.rawlink(done.put)
+
+        try:
+            fill()
+
+            while pending or buffered:
+                if ordered and next_index in buffered:
+                    result = buffered.pop(next_index)
+                else:
+                    thread = done.get()
+                    index = pending.pop(thread)
+                    result = thread.value
+
+                    if ordered and index != next_index:
+                        buffered[index] = result
+
+                        continue
+
+                next_index += 1
+
+                if not isinstance(result, tuple):
+                    # the greenlet was killed
+                    raise ServiceStopping(
+                        '{!r} stopped while mapping {!r}'.format(self, func)
+                    )
+
+                success, value = result
+
+                if not success:
+                    raise value[0], value[1], value[2]
+
+                fill()
+
+                yield value
+        finally:
+            gevent.killall(list(pending))
+
+    def watch_service(self, child):
+        """
+        Watch a child service and if it returns, this service is done. If the
+        child has a restart policy, it is restarted in place instead.
+
+        No greenlet is used, `handle_service_exit` is linked to the child (see
+        `rawlink`).
+        """
+        child.rawlink(self.handle_service_exit)
+
+        if not child.is_running():
+            # the child has already stopped
+            self.handle_service_exit(child)
+
+    def handle_service_exit(self, service):
+        """
+        Called (from the hub, so must not block) when a child service that
+        this parent is watching stops running.
+
+        :param service: The child service object that has stopped.
+        """
+        if self._stopping or self._kill.is_set():
+            return
+
+        policy = self._restart_policies.get(service)
+
+        if policy is None:
+            self._kill.set()
+
+            return
+
+        if not policy.should_restart():
+            # nothing will start it again, don't hold on to it
+            self.remove_service(service)
+            self.check_finished()
+
+            return
+
+        delay = policy.next_delay()
+
+        if delay is None:
+            self.logger.error(
+                '{!r} restarted too many times, stopping', service
+            )
+
+            self._kill.set()
+
+            return
+
+        self.logger.warning('Restarting {!r} in {}s', service, delay)
+
+        # not `spawn`, which may block or fail depending on the pool and rate
+        # limiter options and this is called from the hub
+        try:
+            thread = ServiceGreenlet(
+                self, self.restart_service, service, delay
+            )
+
+            thread.rawlink(self.handle_restart_exit)
+            thread.start()
+        except (Exception, BaseException):
+            self.logger.exception('Unable to restart {!r}, stopping', service)
+
+            self._kill.set()
+
+            return
+
+        self._restarts.add(thread)
+
+    def remove_service(self, child):
+        """
+        Stop tracking a child service that has been added to this service. The
+        child is not stopped.
+
+        Called for children that have exited and will not be restarted.
+        """
+        child.unlink(self.handle_service_exit)
+
+        try:
+            self.services.remove(child)
+        except ValueError:
+            pass
+
+        self._restart_policies.pop(child, None)
+        self._dependencies.pop(child, None)
+
+        for other, dependencies in self._dependencies.items():
+            if child in dependencies:
+                self._dependencies[other] = tuple(
+                    dependency for dependency in dependencies
+                    if dependency is not child
+                )
+
+        subscription = self._error_subscriptions.pop(child, None)
+
+        if subscription is not None:
+            subscription.cancel()
+
+    def handle_restart_exit(self, thread):
+        """
+        Called (from the hub) when a greenlet spawned to restart a child
+        service has finished.
+        """
+        self._restarts.discard(thread)
+
+        if not self._stopping:
+            self.check_finished()
+
+    def restart_service(self, child, delay=0):
+        """
+        Restart a child service after ``delay`` seconds.
+        """
+        gevent.sleep(delay)
+
+        policy = self._restart_policies.get(child)
+
+        if policy is not None:
+            policy.failed = False
+
+        self.emit('restart', child)
+
+        try:
+            child.start(block=True)
+        except Exception:
+            # the exception has already been emitted by the child and it will
+            # be handled by `handle_service_exit`
+            pass
 
 
 class ConfigurableService(Service):
     """
     A service that takes a config dict
+
+    Tunable options (e.g. ``pool_size``, see `Service.get_option`) can be
+    overridden in the config under ``options_key``, so they do not collide
+    with the keys the service uses for its own purposes::
+
+        ConfigurableService({
+            'workers': 4,
+            'service_options': {
+                'pool_size': 100,
+                'stop_timeout': 10,
+            },
+        })
     """
 
     __slots__ = (
         'config',
     )
 
+    # the key of the config that holds the tunable options
+    options_key = 'service_options'
+
     def __init__(self, config, logger=None):
         """
         :param config: Provide a dict like interface
@@ -333,6 +1564,16 @@ class ConfigurableService(Service):
         """
         return {}
 
+    def get_option(self, name):
+        """
+        Tunable options (e.g. ``pool_size``) can be overridden by the config,
+        under ``options_key``.
+        """
+        default = super(ConfigurableService, self).get_option(name)
+        options = self.config.get(self.options_key) or {}
+
+        return options.get(name, default)
+
     def apply_default_config(self, config):
         defaults = self.get_config_defaults()
 
@@ -0,0 +1,129 @@
+"""
+Restart policies for child services, similar to Erlang/OTP supervisors.
+"""
+
+import collections
+import time
+
+
+__all__ = [
+    'RestartPolicy',
+    'PERMANENT',
+    'TRANSIENT',
+    'TEMPORARY',
+]
+
+
+#: the child is always restarted
+PERMANENT = 'permanent'
+#: the child is only restarted if it failed (i.e. emitted an error)
+TRANSIENT = 'transient'
+#: the child is never restarted
+TEMPORARY = 'temporary'
+
+RESTART_TYPES = (PERMANENT, TRANSIENT, TEMPORARY)
+
+
+class RestartPolicy(object):
+    """
+    Decides whether a child service that has exited is restarted and how long
+    to wait before doing so.
+
+    Restarts back off exponentially, starting at ``backoff`` seconds and
+    doubling for each restart within the last ``window`` seconds (up to
+    ``max_backoff``). If the child needs more than ``max_restarts`` restarts
+    within ``window`` seconds, the failure is escalated to the parent service,
+    which is stopped.
+
+    A child that exits and is not restarted (because it is `TEMPORARY` or
+    because it is `TRANSIENT` and exited cleanly) does not stop the parent.
+
+    :ivar restart: One of `PERMANENT`, `TRANSIENT` or `TEMPORARY`.
+    :ivar restarts: The times of the restarts within the current window.
+    :ivar failed: Whether the child has failed since it was last started.
+    """
+
+    __slots__ = (
+        'restart',
+        'max_restarts',
+        'window',
+        'backoff',
+        'max_backoff',
+        'restarts',
+        'failed',
+    )
+
+    def __init__(self, restart=PERMANENT, max_restarts=5, window=60.0,
+                 backoff=0.01, max_backoff=5.0):
+        if restart not in RESTART_TYPES:
+            raise ValueError('Unknown restart type {!r}'.format(restart))
+
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.window = window
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.restarts = collections.deque()
+        self.failed = False
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(
+            self.__class__.__name__, self.restart, id(self)
+        )
+
+    def copy(self):
+        """
+        Return a new policy with the same settings (but none of the state).
+        """
+        return self.__class__(
+            restart=self.restart,
+            max_restarts=self.max_restarts,
+            window=self.window,
+            backoff=self.backoff,
+            max_backoff=self.max_backoff,
+        )
+
+    def should_restart(self):
+        """
+        Whether the child should be restarted now that it has exited.
+        """
+        if self.restart == TEMPORARY:
+            return False
+
+        if self.restart == TRANSIENT:
+            return self.failed
+
+        return True
+
+    def next_delay(self, now=None):
+        """
+        Record a restart and return the number of seconds to wait before
+        restarting the child. Returns `None` if the child has been restarted
+        too often and the failure must be escalated.
+        """
+        if now is None:
+            now = time.time()
+
+        while self.restarts and self.restarts[0] <= now - self.window:
+            self.restarts.popleft()
+
+        if len(self.restarts) >= self.max_restarts:
+            return None
+
+        delay = min(self.max_backoff, self.backoff * 2 ** len(self.restarts))
+
+        self.restarts.append(now)
+
+        return delay
+
+
+def make_policy(restart):
+    """
+    Return a `RestartPolicy` for ``restart``, which may be a restart type or a
+    policy to copy.
+    """
+    if isinstance(restart, RestartPolicy):
+        return restart.copy()
+
+    return RestartPolicy(restart)
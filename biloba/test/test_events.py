@@ -2,9 +2,14 @@
 Tests for ``biloba.events``
 """
 
+import functools
+import gc
 import unittest
 import mock
 
+import gevent
+import logbook
+
 from biloba import events
 
 
@@ -161,6 +166,157 @@ class EventEmitterTestCase(unittest.TestCase):
         self.assertEqual(emitter.listeners('foo'), [])
         self.assertNotEqual(emitter.listeners('bar'), [])
 
+    def test_absent_events(self):
+        """
+        Emitting, getting the listeners of or removing a listener from an
+        event that nobody listens to must not add the event to the emitter.
+        """
+        emitter = events.EventEmitter()
+
+        self.assertFalse(emitter.emit('foo'))
+        self.assertEqual(emitter.listeners('foo'), [])
+
+        with self.assertRaises(ValueError):
+            emitter.remove_listener('foo', lambda: None)
+
+        self.assertEqual(emitter._events, {})
+
+        func = emitter.on('foo', lambda: None)
+        emitter.remove_listener('foo', func)
+
+        self.assertEqual(emitter._events, {})
+
+    def test_star_in_name(self):
+        """
+        An event name containing '*' in a segment is not a pattern.
+        """
+        emitter = events.EventEmitter()
+        func = mock.Mock()
+
+        emitter.on('price*', func)
+
+        self.assertTrue(emitter.emit('price*', 1))
+        self.assertFalse(emitter.emit('prices', 2))
+
+        func.assert_called_once_with(1)
+
+    def test_remove_while_emitting(self):
+        """
+        Removing a listener while the event is being emitted must not stop the
+        other listeners from being called.
+        """
+        emitter = events.EventEmitter()
+        calls = []
+
+        @emitter.once('foo')
+        def first():
+            calls.append('first')
+
+        @emitter.on('foo')
+        def second():
+            calls.append('second')
+
+        emitter.emit('foo')
+
+        self.assertEqual(calls, ['first', 'second'])
+        self.assertEqual(emitter.listeners('foo'), [second])
+
+    def test_subscribe(self):
+        """
+        ``EventEmitter.subscribe`` must return a subscription that removes the
+        listener when cancelled.
+        """
+        emitter = events.EventEmitter()
+        func = mock.Mock()
+
+        subscription = emitter.subscribe('foo', func)
+
+        self.assertTrue(subscription.active)
+        self.assertEqual(emitter.listeners('foo'), [func])
+
+        emitter.emit('foo', 1)
+        subscription.cancel()
+        subscription.cancel()
+
+        self.assertFalse(subscription.active)
+        self.assertFalse(emitter.emit('foo', 2))
+        func.assert_called_once_with(1)
+        self.assertEqual(emitter._events, {})
+
+    def test_subscribe_once(self):
+        """
+        A subscription made with ``once`` must be cancelled before its
+        listener is called.
+        """
+        emitter = events.EventEmitter()
+        calls = []
+
+        def on_foo():
+            calls.append(subscription.active)
+
+            # emitting again must not call the listener again
+            emitter.emit('foo')
+
+        subscription = emitter.subscribe('foo', on_foo, once=True)
+
+        emitter.emit('foo')
+
+        self.assertEqual(calls, [False])
+
+    def test_cancel_while_emitting(self):
+        """
+        Listeners cancelled while the event is being emitted must not be
+        called and listeners added must only be called by the next emit.
+        """
+        emitter = events.EventEmitter()
+        added = mock.Mock()
+
+        def first():
+            second.cancel()
+            emitter.on('foo', added)
+
+        emitter.on('foo', first)
+        second = emitter.subscribe('foo', mock.Mock())
+
+        emitter.emit('foo')
+
+        self.assertFalse(second.func.called)
+        self.assertFalse(added.called)
+
+        emitter.emit('foo')
+
+        self.assertTrue(added.called)
+
+    def test_compact(self):
+        """
+        Cancelled subscriptions must be removed once at least half of the
+        subscriptions to an event are cancelled.
+        """
+        emitter = events.EventEmitter()
+
+        subscriptions = [
+            emitter.subscribe('foo', mock.Mock()) for _ in range(10)
+        ]
+
+        for subscription in subscriptions[:5]:
+            subscription.cancel()
+
+        self.assertEqual(len(emitter._events['foo']), 10)
+
+        subscriptions[5].cancel()
+
+        self.assertEqual(emitter._events['foo'], subscriptions[6:])
+
+        emitter.remove_all_listeners('foo')
+
+        self.assertFalse(subscriptions[9].active)
+
+        # cancelling after all listeners were removed must do nothing
+        subscriptions[9].cancel()
+
+        self.assertEqual(emitter._events, {})
+        self.assertEqual(emitter._cancelled, {})
+
     def test_emit_error_instance(self):
         """
         Emitting an ``error`` event must supply the correct args to the
@@ -252,6 +408,403 @@ class EventEmitterTestCase(unittest.TestCase):
         self.assertIs(ctx.exception, exc)
 
 
+class Listener(object):
+    def __init__(self):
+        self.calls = []
+
+    def on_foo(self, *args):
+        self.calls.append(args)
+
+
+class WeakListenerTestCase(unittest.TestCase):
+    """
+    Tests for weak listeners, see ``events.WeakListener``.
+    """
+
+    def test_bound_method(self):
+        """
+        A weak bound method listener must be called while its instance is
+        alive and removed once it is collected.
+        """
+        emitter = events.EventEmitter()
+        listener = Listener()
+
+        subscription = emitter.subscribe('foo', listener.on_foo, weak=True)
+
+        self.assertEqual(emitter.listeners('foo'), [listener.on_foo])
+
+        emitter.emit('foo', 1)
+
+        self.assertEqual(listener.calls, [(1,)])
+
+        del listener
+
+        self.assertFalse(subscription.active)
+        self.assertEqual(emitter.listeners('foo'), [])
+        self.assertFalse(emitter.emit('foo', 2))
+
+    def test_function(self):
+        """
+        A weak function listener must be removed once it is collected.
+        """
+        emitter = events.EventEmitter()
+        calls = []
+
+        def on_foo():
+            calls.append(True)
+
+        emitter.on('foo', on_foo, weak=True)
+        emitter.emit('foo')
+
+        self.assertEqual(calls, [True])
+
+        del on_foo
+
+        self.assertEqual(emitter._events, {})
+
+    def test_partial(self):
+        """
+        Only the instance of a partial wrapping a bound method must be weakly
+        referenced.
+        """
+        emitter = events.EventEmitter()
+        listener = Listener()
+
+        emitter.on('foo', functools.partial(listener.on_foo, 1), weak=True)
+        emitter.emit('foo', 2)
+
+        self.assertEqual(listener.calls, [(1, 2)])
+
+        del listener
+
+        self.assertEqual(emitter._events, {})
+
+    def test_remove_listener(self):
+        """
+        A weak listener must be able to be removed by the listener it was
+        registered with.
+        """
+        emitter = events.EventEmitter()
+        listener = Listener()
+
+        emitter.on('foo', listener.on_foo, weak=True)
+        emitter.remove_listener('foo', listener.on_foo)
+
+        self.assertEqual(emitter._events, {})
+
+    def test_leak(self):
+        """
+        Subscribing many short lived objects must not grow the memory used by
+        the emitter.
+        """
+        emitter = events.EventEmitter()
+
+        # warm up
+        for _ in range(1000):
+            emitter.on('foo', Listener().on_foo, weak=True)
+
+        gc.collect()
+        before = len(gc.get_objects())
+
+        for _ in range(200000):
+            emitter.on('foo', Listener().on_foo, weak=True)
+
+        gc.collect()
+
+        self.assertLess(len(gc.get_objects()) - before, 100)
+        self.assertEqual(emitter._events, {})
+
+
+class PatternTestCase(unittest.TestCase):
+    """
+    Tests for subscribing to event patterns.
+    """
+
+    def test_emit(self):
+        """
+        Listeners of the patterns that match an event must be called after
+        the listeners of the event.
+        """
+        emitter = events.EventEmitter()
+        calls = []
+
+        emitter.on('conn.**', lambda *args: calls.append(('**',) + args))
+        emitter.on('conn.*', lambda *args: calls.append(('*',) + args))
+        emitter.on('conn.open', lambda *args: calls.append(('open',) + args))
+
+        self.assertTrue(emitter.emit('conn.open', 1))
+        self.assertEqual(calls, [('open', 1), ('**', 1), ('*', 1)])
+
+        del calls[:]
+
+        self.assertTrue(emitter.emit('conn.close.timeout', 2))
+        self.assertEqual(calls, [('**', 2)])
+
+        del calls[:]
+
+        self.assertFalse(emitter.emit('other.open'))
+        self.assertEqual(calls, [])
+
+    def test_error(self):
+        """
+        An 'error' event is handled by the listeners of a matching pattern.
+        """
+        emitter = events.EventEmitter()
+        on_error = mock.Mock()
+
+        emitter.on('*', on_error)
+
+        self.assertTrue(emitter.emit('error', RuntimeError()))
+        self.assertTrue(on_error.called)
+
+    def test_cancel(self):
+        """
+        Cancelling the last subscription to a pattern must remove it from the
+        index.
+        """
+        emitter = events.EventEmitter()
+        func = mock.Mock()
+
+        subscription = emitter.subscribe('conn.*', func)
+
+        self.assertEqual(emitter.listeners('conn.*'), [func])
+
+        emitter.emit('conn.open')
+        subscription.cancel()
+        emitter.emit('conn.open')
+
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(len(emitter._index), 0)
+        self.assertEqual(emitter._patterns, {})
+
+        emitter.on('conn.*', func)
+        emitter.remove_all_listeners()
+
+        self.assertEqual(len(emitter._index), 0)
+        self.assertFalse(emitter.emit('conn.open'))
+
+
+class PatternIndexTestCase(unittest.TestCase):
+    """
+    Tests for ``events.PatternIndex``.
+    """
+
+    def test_match(self):
+        index = events.PatternIndex()
+
+        for pattern in ['a.**', 'a.*', '*.b', 'a.**.c', '**']:
+            index.add(pattern)
+
+        self.assertEqual(index.match('a'), ('a.**', '**'))
+        self.assertEqual(index.match('a.b'), ('a.**', 'a.*', '*.b', '**'))
+        self.assertEqual(index.match('a.c'), ('a.**', 'a.*', 'a.**.c', '**'))
+        self.assertEqual(index.match('a.b.c'), ('a.**', 'a.**.c', '**'))
+        self.assertEqual(index.match('b'), ('**',))
+
+    def test_invalid(self):
+        index = events.PatternIndex()
+
+        with self.assertRaises(ValueError):
+            index.add('a.b*')
+
+        with self.assertRaises(ValueError):
+            index.add('a.*.b*')
+
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.root, [{}, None])
+
+    def test_is_pattern(self):
+        self.assertTrue(events.is_pattern('*'))
+        self.assertTrue(events.is_pattern('a.*'))
+        self.assertTrue(events.is_pattern('a.**.b'))
+        self.assertFalse(events.is_pattern('a'))
+        self.assertFalse(events.is_pattern('price*'))
+        self.assertFalse(events.is_pattern('a.b*'))
+        self.assertFalse(events.is_pattern(None))
+
+    def test_remove(self):
+        """
+        Removing patterns must prune the trie and clear the cache.
+        """
+        index = events.PatternIndex()
+
+        index.add('a.*.c')
+        index.add('a.*')
+
+        self.assertEqual(index.match('a.b'), ('a.*',))
+
+        index.remove('a.*')
+
+        self.assertEqual(index.cache, {})
+        self.assertEqual(index.match('a.b'), ())
+        self.assertEqual(index.match('a.b.c'), ('a.*.c',))
+
+        index.remove('a.*.c')
+
+        self.assertEqual(index.root, [{}, None])
+
+    def test_cache_size(self):
+        index = events.PatternIndex(cache_size=2)
+
+        index.add('*')
+
+        for event in ['a', 'b', 'c']:
+            index.match(event)
+
+        self.assertEqual(index.cache, {'c': ('*',)})
+
+
+def make_emitter(**options):
+    emitter_class = type('MyEmitter', (events.EventEmitter,), options)
+
+    return emitter_class()
+
+
+class EmitAsyncTestCase(unittest.TestCase):
+    """
+    Tests for ``EventEmitter.emit_async``.
+    """
+
+    def test_emit(self):
+        """
+        Listeners must be called by the dispatcher greenlet in the order the
+        events were queued.
+        """
+        emitter = events.EventEmitter()
+        calls = []
+
+        @emitter.on('foo')
+        def on_foo(value):
+            calls.append((value, gevent.getcurrent()))
+
+            gevent.sleep(0)
+
+        for i in range(3):
+            self.assertTrue(emitter.emit_async('foo', i))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(emitter._dispatcher.stats()['depth'], 3)
+
+        self.assertTrue(emitter.flush_events())
+
+        self.assertEqual([value for value, _ in calls], [0, 1, 2])
+        self.assertEqual(len(set(greenlet for _, greenlet in calls)), 1)
+        self.assertIsNot(calls[0][1], gevent.getcurrent())
+        self.assertEqual(emitter._dispatcher.stats(), {
+            'depth': 0,
+            'max_depth': 3,
+            'queued': 3,
+            'dispatched': 3,
+            'dropped': 0,
+        })
+        self.assertIsNone(emitter._dispatcher.greenlet)
+
+    def test_drop(self):
+        """
+        Events must be dropped when the queue is full.
+        """
+        emitter = make_emitter(emit_buffer_size=2)
+        func = mock.Mock()
+
+        emitter.on('foo', func)
+
+        results = [emitter.emit_async('foo', i) for i in range(3)]
+
+        emitter.flush_events()
+
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(func.call_count, 2)
+        self.assertEqual(emitter._dispatcher.dropped, 1)
+
+    def test_block(self):
+        """
+        The 'block' policy must block the emitting greenlet while the queue is
+        full.
+        """
+        emitter = make_emitter(
+            emit_buffer_size=2, emit_overflow=events.BLOCK
+        )
+        func = mock.Mock()
+
+        emitter.on('foo', func)
+
+        for i in range(5):
+            self.assertTrue(emitter.emit_async('foo', i))
+
+        emitter.flush_events()
+
+        self.assertEqual(
+            [args for args, _ in func.call_args_list],
+            [(0,), (1,), (2,), (3,), (4,)]
+        )
+
+    def test_block_relay(self):
+        """
+        A listener that emits asynchronously on its own emitter must not
+        block the dispatcher when the queue is full, the event is dropped.
+        """
+        emitter = make_emitter(
+            emit_buffer_size=1, emit_overflow=events.BLOCK
+        )
+        bar = mock.Mock()
+
+        @emitter.on('foo')
+        def relay():
+            emitter.emit_async('bar')
+            emitter.emit_async('bar')
+
+        emitter.on('bar', bar)
+
+        emitter.emit_async('foo')
+
+        self.assertTrue(emitter.flush_events(1))
+        self.assertEqual(bar.call_count, 1)
+        self.assertEqual(emitter._dispatcher.stats()['dropped'], 1)
+        self.assertEqual(emitter._dispatcher.stats()['depth'], 0)
+
+    def test_error(self):
+        """
+        Exceptions raised by listeners must be emitted as 'error' events and
+        must not stop the dispatcher.
+        """
+        emitter = events.EventEmitter()
+        on_error = mock.Mock()
+        on_bar = mock.Mock()
+
+        emitter.on('foo', lambda: 1 / 0)
+        emitter.on('bar', on_bar)
+        emitter.on('error', on_error)
+
+        emitter.emit_async('foo')
+        emitter.emit_async('bar')
+        emitter.flush_events()
+
+        self.assertIs(on_error.call_args[0][0], ZeroDivisionError)
+        self.assertTrue(on_bar.called)
+
+    @mock.patch('gevent.hub.Hub.handle_error')
+    def test_unhandled_error(self, mock_handle_error):
+        """
+        Exceptions that are not handled by an 'error' listener must be
+        reported by the hub.
+        """
+        emitter = events.EventEmitter()
+
+        emitter.on('foo', lambda: 1 / 0)
+
+        emitter.emit_async('foo')
+        emitter.flush_events()
+
+        context, exc_type = mock_handle_error.call_args[0][:2]
+
+        self.assertIs(context, emitter)
+        self.assertIs(exc_type, ZeroDivisionError)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            events.AsyncDispatcher(events.EventEmitter(), overflow='foo')
+
+
 class GetExcInfoTestCase(unittest.TestCase):
     """
     Tests for ``events.get_exc_info``
@@ -525,3 +1078,117 @@ class EmitExceptionsTestCase(unittest.TestCase):
                 raise TestException
 
         self.assertFalse(logger.exception.called)
+
+
+class ErrorCoalescerTestCase(unittest.TestCase):
+    """
+    Tests for ``events.ErrorCoalescer``
+    """
+
+    def raise_error(self, exc):
+        raise exc
+
+    def trap(self, coalescer, logger, exc):
+        with events.emit_exceptions(events.EventEmitter(), logger,
+                                    propagate=False, coalescer=coalescer):
+            self.raise_error(exc)
+
+    def test_coalesce(self):
+        """
+        Identical exceptions must be logged once per window and summarised.
+        """
+        emitter = events.EventEmitter()
+        logger = mock.Mock()
+        summaries = []
+
+        emitter.on('error_summary', summaries.append)
+
+        coalescer = events.ErrorCoalescer(emitter, window=0.05, samples=2)
+
+        for _ in range(10):
+            self.trap(coalescer, logger, ValueError('foo'))
+
+        self.trap(coalescer, logger, KeyError('bar'))
+
+        # 2 samples of the ValueError and the KeyError
+        self.assertEqual(logger.error.call_count, 3)
+        self.assertEqual(coalescer.suppressed, 8)
+
+        gevent.sleep(0.1)
+
+        self.assertEqual(logger.error.call_count, 4)
+
+        summary, = summaries
+
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0]['type'], ValueError)
+        self.assertEqual(summary[0]['message'], 'foo')
+        self.assertEqual(summary[0]['count'], 10)
+        self.assertEqual(summary[0]['suppressed'], 8)
+        self.assertEqual(summary[0]['filename'], __file__.rstrip('c'))
+
+        # a new window
+        self.trap(coalescer, logger, ValueError('foo'))
+
+        self.assertEqual(logger.error.call_count, 5)
+        self.assertEqual(coalescer.flush(), [])
+
+    def test_location(self):
+        """
+        Exceptions of the same type raised in different places must not be
+        coalesced.
+        """
+        emitter = events.EventEmitter()
+        logger = mock.Mock()
+        coalescer = events.ErrorCoalescer(emitter, window=10)
+
+        self.trap(coalescer, logger, ValueError())
+
+        with events.emit_exceptions(emitter, logger, propagate=False,
+                                    coalescer=coalescer):
+            raise ValueError()
+
+        self.assertEqual(logger.error.call_count, 2)
+
+        coalescer.flush()
+
+    def test_unicode(self):
+        """
+        Exceptions with non-ascii messages must be coalesced and summarised.
+        """
+        emitter = events.EventEmitter()
+        handler = logbook.TestHandler()
+        coalescer = events.ErrorCoalescer(emitter, window=10)
+
+        with handler.applicationbound():
+            for _ in range(2):
+                self.trap(coalescer, logbook.Logger('test'),
+                          ValueError(u'caf\xe9'))
+
+            self.trap(coalescer, logbook.Logger('test'),
+                      ValueError('caf\xc3\xa9'))
+
+            summary = coalescer.flush()
+
+        self.assertEqual(summary[0]['message'], u'caf\xe9')
+        self.assertEqual(summary[0]['count'], 3)
+        self.assertEqual(len(handler.records), 2)
+        self.assertIn(u'caf\xe9', handler.records[-1].message)
+
+        # undecodable messages fall back to the repr
+        self.assertEqual(
+            events.get_message(ValueError('caf\xc3\xa9')),
+            u"ValueError('caf\\xc3\\xa9',)"
+        )
+
+    def test_broken(self):
+        """
+        If the coalescer fails, the exception must still be logged.
+        """
+        logger = mock.Mock()
+        coalescer = events.ErrorCoalescer(events.EventEmitter(), window=10)
+
+        with mock.patch.object(events, 'get_location', side_effect=TypeError):
+            self.trap(coalescer, logger, ValueError())
+
+        self.assertEqual(logger.error.call_count, 1)
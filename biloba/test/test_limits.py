@@ -0,0 +1,192 @@
+"""
+Tests for `biloba.limits`.
+"""
+
+import time
+import unittest
+
+import gevent
+
+from biloba import limits
+
+
+class AdaptiveLimiterTestCase(unittest.TestCase):
+    """
+    Tests for `limits.AdaptiveLimiter`.
+    """
+
+    def test_increase(self):
+        """
+        Fast tasks must increase the limit while it is being used.
+        """
+        limiter = limits.AdaptiveLimiter(1.0, initial=4, max_limit=5)
+
+        for _ in range(4):
+            limiter.acquire()
+
+        for _ in range(4):
+            limiter.release(0.1, now=0)
+
+        self.assertTrue(limiter.limit > 4)
+
+        # the limit is not used
+        limit = limiter.limit
+
+        limiter.acquire()
+        limiter.release(0.1, now=0)
+
+        self.assertEqual(limiter.limit, limit)
+
+        for _ in range(100):
+            size = limiter.size
+
+            for _ in range(size):
+                limiter.acquire()
+
+            for _ in range(size):
+                limiter.release(0.1, now=0)
+
+        self.assertEqual(limiter.size, 5)
+
+    def test_decrease(self):
+        """
+        A slow task must decrease the limit, once per ``target`` seconds.
+        """
+        limiter = limits.AdaptiveLimiter(
+            1.0, initial=10, min_limit=2, backoff=0.5
+        )
+
+        limiter.update(2.0, now=10)
+        limiter.update(2.0, now=10.5)
+
+        self.assertEqual(limiter.size, 5)
+
+        limiter.update(2.0, now=11)
+        limiter.update(2.0, now=12)
+        limiter.update(2.0, now=13)
+
+        # never below ``min_limit``
+        self.assertEqual(limiter.size, 2)
+        self.assertEqual(limiter.decreases, 3)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    """
+    Tests for `limits.RateLimiter`.
+    """
+
+    def setUp(self):
+        self.limiter = limits.RateLimiter(
+            100, burst=5, idle_timeout=0.05, interval=0.01
+        )
+        self.limiter.start()
+
+    def tearDown(self):
+        self.limiter.stop()
+
+    def test_burst(self):
+        """
+        A full bucket must allow a burst and then limit the rate.
+        """
+        for _ in range(5):
+            self.assertTrue(self.limiter.acquire(block=False))
+
+        self.assertFalse(self.limiter.acquire(block=False))
+
+        start = time.time()
+
+        for _ in range(5):
+            self.assertTrue(self.limiter.acquire())
+
+        # 5 tokens at 100/s
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_keys(self):
+        """
+        Each key must have its own bucket.
+        """
+        for _ in range(5):
+            self.limiter.acquire('foo')
+
+        self.assertFalse(self.limiter.acquire('foo', block=False))
+        self.assertTrue(self.limiter.acquire('bar', block=False))
+        self.assertEqual(sorted(self.limiter.buckets), ['bar', 'foo'])
+
+    def test_timeout(self):
+        """
+        A waiter that times out must not consume tokens.
+        """
+        for _ in range(5):
+            self.limiter.acquire()
+
+        self.assertFalse(self.limiter.acquire(tokens=5, timeout=0.01))
+
+        bucket = self.limiter.buckets[None]
+
+        self.assertEqual(len(bucket.waiters), 0)
+
+        with self.assertRaises(ValueError):
+            self.limiter.acquire(tokens=6)
+
+    def test_evict(self):
+        """
+        Idle full buckets must be evicted.
+        """
+        for key in range(10):
+            self.limiter.acquire(key)
+
+        self.assertEqual(len(self.limiter), 10)
+
+        gevent.sleep(0.15)
+
+        self.assertEqual(len(self.limiter), 0)
+        self.assertEqual(self.limiter.evicted, 10)
+
+    def test_top_up(self):
+        """
+        Tokens must accrue while the refill timer is stopped.
+        """
+        self.limiter.stop()
+
+        for _ in range(5):
+            self.limiter.acquire()
+
+        self.assertFalse(self.limiter.acquire(block=False))
+
+        self.limiter.buckets[None].updated -= 0.02
+
+        self.assertTrue(self.limiter.acquire(block=False))
+        self.assertTrue(self.limiter.acquire(block=False))
+        self.assertFalse(self.limiter.acquire(block=False))
+
+    def test_refill_order(self):
+        """
+        A bucket whose waiters are served by a refill must be moved to the end
+        of the buckets, so it does not hold up the eviction of idle buckets.
+        """
+        self.limiter.stop()
+
+        for _ in range(5):
+            self.limiter.acquire('foo')
+
+        waiter = gevent.spawn(self.limiter.acquire, 'foo')
+        gevent.sleep(0)
+
+        self.limiter.acquire('bar')
+
+        self.limiter.buckets['foo'].updated -= 0.1
+        self.limiter.refill()
+
+        self.assertTrue(waiter.get())
+        self.assertEqual(list(self.limiter.buckets), ['bar', 'foo'])
+
+    def test_stop(self):
+        """
+        A stopped limiter must not refill.
+        """
+        self.limiter.stop()
+
+        for _ in range(5):
+            self.limiter.acquire()
+
+        self.assertFalse(self.limiter.acquire(timeout=0.05))
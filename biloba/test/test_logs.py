@@ -0,0 +1,125 @@
+"""
+Tests for `biloba.logs`.
+"""
+
+import unittest
+
+import gevent
+import logbook
+
+from biloba import logs
+
+
+class SlowHandler(logbook.TestHandler):
+    """
+    A test handler that yields to the hub for every record.
+    """
+
+    def emit(self, record):
+        gevent.sleep(0)
+
+        logbook.TestHandler.emit(self, record)
+
+
+class AsyncLogServiceTestCase(unittest.TestCase):
+    """
+    Tests for `logs.AsyncLogService`.
+    """
+
+    def make_service(self, **options):
+        options.setdefault('log_buffer_size', 5)
+        options.setdefault('log_batch_size', 2)
+
+        log_service_class = type(
+            'MyLogService', (logs.AsyncLogService,), options
+        )
+
+        return log_service_class(SlowHandler())
+
+    def test_log(self):
+        """
+        Records must be handled by the handler in batches and all buffered
+        records must be handled when the service stops.
+        """
+        log_service = self.make_service()
+        logger = logbook.Logger('test')
+
+        log_service.start()
+
+        for i in range(4):
+            logger.info('message {}', i)
+
+        # nothing has been written by the greenlet that logged
+        self.assertEqual(log_service.handler.records, [])
+        self.assertEqual(log_service.stats()['buffered'], 4)
+
+        log_service.stop()
+
+        self.assertEqual(
+            [record.message for record in log_service.handler.records],
+            ['message 0', 'message 1', 'message 2', 'message 3']
+        )
+        self.assertEqual(log_service.batches, 2)
+        self.assertEqual(log_service.written, 4)
+
+        # the handler has been removed from the stack
+        logger.info('foo')
+
+        self.assertEqual(log_service.written, 4)
+
+    def test_drop(self):
+        """
+        Records must be dropped when the buffer is full.
+        """
+        log_service = self.make_service()
+        logger = logbook.Logger('test')
+
+        log_service.start()
+
+        for i in range(10):
+            logger.info('message {}', i)
+
+        log_service.stop()
+
+        self.assertEqual(log_service.dropped, 5)
+        self.assertEqual(log_service.written, 5)
+
+    def test_block(self):
+        """
+        The 'block' policy must block the greenlet that is logging while the
+        buffer is full.
+        """
+        log_service = self.make_service(log_overflow=logs.BLOCK)
+        logger = logbook.Logger('test')
+
+        log_service.start()
+
+        for i in range(10):
+            logger.info('message {}', i)
+
+        log_service.stop()
+
+        self.assertEqual(log_service.dropped, 0)
+        self.assertEqual(log_service.written, 10)
+
+    def test_thread(self):
+        """
+        Records must be able to be handled in a native thread.
+        """
+        log_service = self.make_service(log_in_thread=True)
+        logger = logbook.Logger('test')
+
+        log_service.start()
+
+        logger.warning('foo')
+
+        log_service.stop()
+
+        self.assertTrue(log_service.handler.has_warning('foo'))
+
+    def test_invalid_policy(self):
+        """
+        An unknown overflow policy must raise `ValueError`.
+        """
+        with self.assertRaises(ValueError):
+            self.make_service(log_overflow='foo')
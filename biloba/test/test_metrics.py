@@ -0,0 +1,37 @@
+"""
+Tests for `biloba.metrics`.
+"""
+
+import unittest
+
+from biloba import metrics
+
+
+class MeterTestCase(unittest.TestCase):
+    """
+    Tests for `metrics.Meter`.
+    """
+
+    def test_rate(self):
+        """
+        A steady rate of events must be measured and decay when idle.
+        """
+        meter = metrics.Meter(half_life=1.0)
+
+        for i in range(1000):
+            meter.mark(now=i * 0.01)
+
+        self.assertEqual(meter.count, 1000)
+        self.assertAlmostEqual(meter.rate(now=10), 100, delta=1)
+
+        # one half life later
+        self.assertAlmostEqual(meter.rate(now=11), 50, delta=1)
+
+    def test_idle(self):
+        """
+        A meter that has not been marked has no rate.
+        """
+        meter = metrics.Meter()
+
+        self.assertEqual(meter.rate(), 0)
+        self.assertEqual(meter.count, 0)
@@ -0,0 +1,132 @@
+"""
+Tests for `biloba.monitor`.
+"""
+
+import time
+import unittest
+
+import mock
+import gevent
+
+from biloba import monitor, service
+
+
+def hog(seconds):
+    # does not yield to the hub
+    time.sleep(seconds)
+
+
+class BlockingMonitorTestCase(unittest.TestCase):
+    """
+    Tests for `monitor.BlockingMonitor`.
+    """
+
+    def setUp(self):
+        self.parent = service.Service(logger=mock.Mock())
+        self.child = service.Service(logger=mock.Mock())
+
+        self.parent.add_service(self.child)
+
+        self.monitor = monitor.BlockingMonitor(self.parent, threshold=0.05)
+        self.monitor.start()
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_blocked(self):
+        """
+        A greenlet that blocks the hub must be reported by the service that
+        spawned it.
+        """
+        blocked = []
+
+        self.child.on('blocked', lambda *args: blocked.append(args))
+
+        thread = self.child.spawn(hog, 0.2)
+
+        thread.join()
+        gevent.sleep(0.01)
+
+        self.assertEqual(self.monitor.reports, 1)
+
+        (greenlet, duration, stack), = blocked
+
+        self.assertIs(greenlet, thread)
+        self.assertTrue(duration >= 0.05)
+        self.assertIn('hog', stack)
+        self.assertTrue(self.child.logger.warning.called)
+        self.assertFalse(self.parent.logger.warning.called)
+
+    def test_not_blocked(self):
+        """
+        Greenlets that yield must not be reported.
+        """
+        def work():
+            for _ in range(10):
+                gevent.sleep(0.01)
+
+        self.child.spawn(work).join()
+        gevent.sleep(0.01)
+
+        self.assertEqual(self.monitor.reports, 0)
+
+    def test_unknown_greenlet(self):
+        """
+        A blocking greenlet that was not spawned by a service in the tree must
+        be reported by the root service.
+        """
+        gevent.spawn(hog, 0.2).join()
+        gevent.sleep(0.01)
+
+        self.assertEqual(self.monitor.reports, 1)
+        self.assertTrue(self.parent.logger.warning.called)
+
+
+class CPUTracerTestCase(unittest.TestCase):
+    """
+    Tests for `monitor.CPUTracer`.
+    """
+
+    def test_report(self):
+        """
+        Time spent running greenlets must be attributed to the service that
+        spawned them and included in its ancestors.
+        """
+        parent = service.Service(logger=mock.Mock())
+        busy = service.Service(logger=mock.Mock())
+        idle = service.Service(logger=mock.Mock())
+
+        parent.add_service(busy)
+        parent.add_service(idle)
+
+        tracer = monitor.CPUTracer(parent)
+        tracer.start()
+
+        try:
+            busy.spawn(hog, 0.05).join()
+            idle.spawn(gevent.sleep, 0.05).join()
+        finally:
+            tracer.stop()
+
+        report = tracer.report()
+
+        self.assertEqual([row['service'] for row in report[:2]], [
+            parent, busy
+        ])
+
+        parent_row, busy_row = report[:2]
+        idle_row = report[2]
+
+        self.assertEqual(parent_row['self'], 0)
+        self.assertTrue(busy_row['self'] >= 0.05)
+        self.assertTrue(idle_row['self'] < 0.01)
+        self.assertEqual(
+            parent_row['inclusive'], busy_row['self'] + idle_row['self']
+        )
+        self.assertTrue(idle_row['switches'] >= 2)
+
+        self.assertEqual(tracer.report(1), [parent_row])
+
+        tracer.reset()
+
+        self.assertEqual(tracer.report(1)[0]['inclusive'], 0)
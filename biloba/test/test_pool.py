@@ -0,0 +1,148 @@
+"""
+Tests for `biloba.pool`.
+"""
+
+import unittest
+
+import gevent
+from gevent import event
+
+from biloba import pool
+
+
+class BoundedPoolTestCase(unittest.TestCase):
+    """
+    Tests for `pool.BoundedPool`.
+    """
+
+    def setUp(self):
+        self.event = event.Event()
+
+    def tearDown(self):
+        self.event.set()
+
+    def test_invalid_policy(self):
+        """
+        An unknown policy must raise `ValueError`.
+        """
+        with self.assertRaises(ValueError):
+            pool.BoundedPool(1, policy='foobar')
+
+    def test_fail(self):
+        """
+        Spawning in to a full pool with the 'fail' policy must raise
+        `PoolFull`.
+        """
+        my_pool = pool.BoundedPool(1, policy=pool.FAIL)
+
+        my_pool.spawn(self.event.wait)
+
+        with self.assertRaises(pool.PoolFull):
+            my_pool.spawn(self.event.wait)
+
+        self.assertEqual(my_pool.rejected, 1)
+        self.assertEqual(len(my_pool), 1)
+
+    def test_block(self):
+        """
+        Spawning in to a full pool with the 'block' policy must wait until a
+        slot is available.
+        """
+        my_pool = pool.BoundedPool(1, policy=pool.BLOCK)
+
+        my_pool.spawn(self.event.wait)
+
+        gevent.spawn_later(0.01, self.event.set)
+
+        thread = my_pool.spawn(lambda: 'foo')
+
+        self.assertTrue(self.event.is_set())
+        self.assertEqual(thread.get(), 'foo')
+        self.assertEqual(my_pool.waits, 1)
+        self.assertTrue(my_pool.wait_time > 0)
+
+    def test_queue(self):
+        """
+        Spawning in to a full pool with the 'queue' policy must start the
+        greenlet once a slot is available.
+        """
+        my_pool = pool.BoundedPool(1, policy=pool.QUEUE, backlog=1)
+
+        my_pool.spawn(self.event.wait)
+        thread = my_pool.spawn(lambda: 'foo')
+
+        self.assertEqual(my_pool.queued, 1)
+        self.assertEqual(list(my_pool.backlog), [thread])
+        self.assertEqual(len(my_pool), 1)
+
+        with self.assertRaises(pool.PoolFull):
+            my_pool.spawn(lambda: 'bar')
+
+        self.assertEqual(my_pool.rejected, 1)
+
+        self.event.set()
+        my_pool.join()
+
+        self.assertEqual(thread.value, 'foo')
+        self.assertEqual(len(my_pool), 0)
+
+    def test_kill_backlog(self):
+        """
+        Killing the pool must prevent any queued greenlets from running.
+        """
+        my_pool = pool.BoundedPool(1, policy=pool.QUEUE, backlog=1)
+
+        my_pool.spawn(self.event.wait)
+        thread = my_pool.spawn(lambda: 'foo')
+
+        my_pool.kill()
+
+        self.assertTrue(thread.dead)
+        self.assertIsInstance(thread.value, gevent.GreenletExit)
+        self.assertEqual(len(my_pool.backlog), 0)
+
+
+class AdaptivePoolTestCase(unittest.TestCase):
+    """
+    Tests for `pool.AdaptivePool`.
+    """
+
+    def test_limit(self):
+        """
+        The pool must block callers at the limit and adapt the limit to the
+        latency of the greenlets.
+        """
+        my_pool = pool.AdaptivePool(0.05, initial=2, max_size=4)
+
+        self.assertEqual(my_pool.size, 2)
+
+        event = gevent.event.Event()
+
+        my_pool.spawn(event.wait)
+        my_pool.spawn(event.wait)
+
+        self.assertTrue(my_pool.full())
+
+        blocked = gevent.spawn(my_pool.spawn, lambda: None)
+        gevent.sleep(0)
+
+        self.assertFalse(blocked.ready())
+
+        event.set()
+        blocked.join()
+        my_pool.join()
+
+        # fast greenlets raise the limit
+        self.assertTrue(my_pool.limiter.limit > 2)
+        self.assertEqual(my_pool.limiter.in_flight, 0)
+
+        limit = my_pool.limiter.limit
+
+        for _ in range(2):
+            my_pool.spawn(gevent.sleep, 0.1)
+
+        my_pool.join()
+
+        # slow greenlets lower it
+        self.assertEqual(my_pool.limiter.decreases, 1)
+        self.assertTrue(my_pool.limiter.limit < limit)
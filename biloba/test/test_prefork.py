@@ -0,0 +1,142 @@
+"""
+Tests for `biloba.prefork`.
+"""
+
+import errno
+import os
+import unittest
+
+import mock
+import gevent
+from gevent import os as gevent_os
+
+from biloba import prefork, service
+
+
+class WorkerService(service.Service):
+    """
+    Reports the pid of the worker process and the address of the shared
+    listener then runs forever.
+    """
+
+    def __init__(self, fd, sockets):
+        super(WorkerService, self).__init__()
+
+        self.fd = fd
+        self.sockets = sockets
+
+    def do_start(self):
+        port = self.sockets[0].getsockname()[1]
+
+        os.write(self.fd, '{} {}\n'.format(os.getpid(), port))
+
+        self.spawn(gevent.sleep, 60)
+
+
+class MySupervisor(prefork.ProcessSupervisorService):
+    fd = None
+
+    def make_worker_service(self, sockets):
+        return WorkerService(self.fd, sockets)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        if exc.errno == errno.ESRCH:
+            return False
+
+        raise
+
+    return True
+
+
+class ProcessSupervisorServiceTestCase(unittest.TestCase):
+    """
+    Tests for `prefork.ProcessSupervisorService`.
+    """
+
+    def setUp(self):
+        read_fd, self.write_fd = os.pipe()
+
+        gevent_os.make_nonblocking(read_fd)
+
+        self.reader = read_fd
+        self.buffer = ''
+
+    def tearDown(self):
+        os.close(self.reader)
+        os.close(self.write_fd)
+
+    def read_worker(self):
+        """
+        Wait for a worker to report its pid and port.
+        """
+        with gevent.Timeout(5):
+            while '\n' not in self.buffer:
+                self.buffer += gevent_os.nb_read(self.reader, 1024)
+
+        line, self.buffer = self.buffer.split('\n', 1)
+
+        return tuple(int(value) for value in line.split())
+
+    def make_supervisor(self, **config):
+        config.setdefault('workers', 2)
+        config.setdefault('listen', ['127.0.0.1:0'])
+        config.setdefault('respawn_delay', 0)
+        config.setdefault('kill_timeout', 1)
+
+        supervisor = MySupervisor(config, logger=mock.Mock())
+        supervisor.fd = self.write_fd
+
+        return supervisor
+
+    def test_default_workers(self):
+        """
+        By default there must be one worker per cpu.
+        """
+        import multiprocessing
+
+        supervisor = MySupervisor(None)
+
+        self.assertEqual(
+            supervisor.config['workers'],
+            multiprocessing.cpu_count()
+        )
+
+    def test_workers(self):
+        """
+        Workers must be forked, share the listening sockets, be respawned and
+        stopped with the supervisor.
+        """
+        supervisor = self.make_supervisor()
+
+        supervisor.start()
+
+        port = supervisor.sockets[0].getsockname()[1]
+        workers = [self.read_worker(), self.read_worker()]
+
+        self.assertEqual(sorted(supervisor.workers), sorted(
+            pid for pid, _ in workers
+        ))
+
+        for pid, worker_port in workers:
+            self.assertEqual(worker_port, port)
+
+        # kill a worker, it must be replaced
+        dead_pid = workers[0][0]
+
+        os.kill(dead_pid, 9)
+
+        new_pid, _ = self.read_worker()
+
+        self.assertNotIn(dead_pid, supervisor.workers)
+        self.assertIn(new_pid, supervisor.workers)
+
+        supervisor.stop()
+
+        self.assertEqual(supervisor.workers, {})
+        self.assertEqual(supervisor.sockets, [])
+        self.assertFalse(is_running(new_pid))
+        self.assertFalse(is_running(workers[1][0]))
@@ -0,0 +1,137 @@
+"""
+Tests for `biloba.process`.
+"""
+
+import os
+import signal
+import unittest
+
+import gevent
+
+from biloba import process
+
+
+def add(a, b):
+    return a + b
+
+
+def get_pid():
+    return os.getpid()
+
+
+def blow_up():
+    raise ValueError('foobar')
+
+
+def spin(seconds):
+    import time
+
+    time.sleep(seconds)
+
+    return seconds
+
+
+def unpicklable():
+    return lambda: None
+
+
+class ProcessPoolTestCase(unittest.TestCase):
+    """
+    Tests for `process.ProcessPool`.
+    """
+
+    def setUp(self):
+        self.pool = process.ProcessPool(2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.kill()
+
+    def test_apply(self):
+        """
+        The function must be called in a different process.
+        """
+        self.assertEqual(self.pool.apply(add, (1, 2)), 3)
+        self.assertNotEqual(self.pool.apply(get_pid), os.getpid())
+
+    def test_error(self):
+        """
+        An exception raised in the worker must be raised by the result.
+        """
+        with self.assertRaises(ValueError) as ctx:
+            self.pool.apply(blow_up)
+
+        self.assertIn('foobar', ctx.exception.remote_traceback)
+
+    def test_unpicklable_result(self):
+        """
+        A result that cannot be pickled must raise `RemoteError`.
+        """
+        with self.assertRaises(process.RemoteError):
+            self.pool.apply(unpicklable)
+
+    def test_does_not_block_hub(self):
+        """
+        Waiting for a result must not block other greenlets.
+        """
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0.01)
+
+        ticker = gevent.spawn(tick)
+
+        try:
+            results = [
+                self.pool.apply_async(spin, (0.1,)),
+                self.pool.apply_async(spin, (0.1,)),
+            ]
+
+            self.assertEqual([result.get() for result in results], [0.1, 0.1])
+        finally:
+            ticker.kill()
+
+        self.assertTrue(len(ticks) > 2)
+
+    def test_worker_died(self):
+        """
+        A worker that dies must fail its task and be replaced.
+        """
+        result = self.pool.apply_async(spin, (10,))
+
+        # give the task time to reach a worker
+        gevent.sleep(0.05)
+
+        # the idle worker will answer, the other one is running the task
+        idle = self.pool.apply(get_pid)
+        victim = [
+            worker.pid for worker in self.pool.workers if worker.pid != idle
+        ][0]
+
+        os.kill(victim, signal.SIGKILL)
+
+        with self.assertRaises(process.WorkerDied):
+            result.get(timeout=5)
+
+        self.assertEqual(self.pool.apply(add, (2, 2)), 4)
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(len(self.pool.workers), 2)
+
+    def test_kill(self):
+        """
+        Killing the pool must fail pending tasks and refuse new ones.
+        """
+        pending = [self.pool.apply_async(spin, (10,)) for _ in range(3)]
+
+        gevent.sleep(0.05)
+
+        self.pool.kill()
+
+        for result in pending:
+            with self.assertRaises(process.ProcessPoolClosed):
+                result.get(timeout=1)
+
+        with self.assertRaises(process.ProcessPoolClosed):
+            self.pool.apply(add, (1, 2))
@@ -2,7 +2,10 @@
 Tests for `biloba.service`.
 """
 
+import gc
+import time
 import unittest
+import weakref
 import mock
 
 import gevent
@@ -142,9 +145,16 @@ class ServiceTestCase(unittest.TestCase):
 
         my_service.add_service(mock_greenlet)
 
-        my_service.join()
+        my_service.start()
+
+        mock_greenlet.start.assert_called_once_with(block=True)
+        mock_greenlet.rawlink.assert_called_once_with(
+            my_service.handle_service_exit
+        )
+
+        my_service.stop()
 
-        mock_greenlet.join.assert_called_once_with()
+        mock_greenlet.stop.assert_called_once_with()
 
     @mock.patch.object(service.Service, 'stop')
     def test_start_emit_error(self, mock_stop):
@@ -319,6 +329,45 @@ class ServiceTestCase(unittest.TestCase):
 
         self.assertTrue(self.executed)
 
+    def test_spawn_greenlet(self):
+        """
+        `spawn` must return a `ServiceGreenlet` that completes successfully
+        even if the function raises.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        thread = my_service.spawn(lambda a, b: a + b, 1, b=2)
+
+        self.assertIsInstance(thread, service.ServiceGreenlet)
+        self.assertIs(thread.service, my_service)
+        self.assertEqual(thread.get(), 3)
+
+        thread = my_service.spawn(lambda: 1 / 0)
+        thread.join()
+
+        self.assertTrue(thread.successful())
+        self.assertIsNone(thread.value)
+        self.assertTrue(my_service.logger.error.called)
+
+    @mock.patch('gevent.hub.Hub.handle_error')
+    @mock.patch.object(
+        service.Service, 'handle_exception', side_effect=RuntimeError
+    )
+    def test_spawn_greenlet_handler_error(self, mock_handle_exception,
+                                          mock_handle_error):
+        """
+        If handling the exception raised by a `ServiceGreenlet` fails, the
+        greenlet must still complete, with the original exception.
+        """
+        my_service = make_service()
+
+        thread = my_service.spawn(lambda: 1 / 0)
+        thread.join(timeout=1)
+
+        self.assertTrue(thread.ready())
+        self.assertIsInstance(thread.exception, ZeroDivisionError)
+        self.assertTrue(mock_handle_error.called)
+
     def test_spawn_exit(self):
         """
         Raising `gevent.GreenletExit` is not an error as such and the thread
@@ -343,6 +392,247 @@ class ServiceTestCase(unittest.TestCase):
 
         self.assertTrue(self.executed)
 
+    def test_bounded_pool(self):
+        """
+        Setting `pool_size` must bound the number of spawned greenlets.
+        """
+        from biloba import pool
+
+        class MyService(service.Service):
+            pool_size = 1
+            pool_policy = pool.FAIL
+
+        my_service = MyService()
+
+        self.assertIsInstance(my_service.pool, pool.BoundedPool)
+
+        my_service.spawn(gevent.sleep, 1)
+
+        with self.assertRaises(pool.PoolFull):
+            my_service.spawn(gevent.sleep, 1)
+
+        my_service.pool.kill()
+
+    def test_adaptive_pool(self):
+        """
+        Setting `adaptive_latency` must adapt the number of concurrent
+        greenlets and report the limit in `stats`.
+        """
+        from biloba import pool
+
+        class MyService(service.Service):
+            pool_size = 50
+            adaptive_latency = 0.1
+
+        my_service = MyService()
+
+        self.assertIsInstance(my_service.pool, pool.AdaptivePool)
+        self.assertEqual(my_service.pool.limiter.max_limit, 50)
+        self.assertEqual(my_service.stats()['limit'], 10)
+        self.assertIsNone(make_service().stats()['limit'])
+
+    def test_rate_limit(self):
+        """
+        Setting `rate_limit` must limit the rate of `spawn` while the service
+        is running and the refill timer must be stopped with the service.
+        """
+        class MyService(SimpleService):
+            rate_limit = 100
+            rate_burst = 2
+
+        my_service = MyService()
+
+        my_service.start()
+
+        limiter = my_service.rate_limiter
+        other = my_service.make_rate_limiter(1)
+
+        self.assertTrue(limiter.started)
+        self.assertTrue(other.started)
+
+        start = time.time()
+
+        for _ in range(6):
+            my_service.spawn(lambda: None)
+
+        self.assertTrue(time.time() - start >= 0.03)
+
+        my_service.stop()
+
+        self.assertFalse(limiter.started)
+        self.assertFalse(other.started)
+
+        # spawning while the service is stopped must not block
+        with gevent.Timeout(1):
+            for _ in range(6):
+                my_service.spawn(lambda: None).join()
+
+    def test_rate_limit_not_started(self):
+        """
+        `spawn` must not be limited before the service is started.
+        """
+        class MyService(SimpleService):
+            rate_limit = 1
+            rate_burst = 1
+
+        my_service = MyService()
+
+        with gevent.Timeout(1):
+            for _ in range(3):
+                my_service.spawn(lambda: None).join()
+
+    def test_error_coalescing(self):
+        """
+        Setting `error_coalesce_window` must coalesce identical exceptions and
+        log the summary when the service stops.
+        """
+        class MyService(SimpleService):
+            error_coalesce_window = 10
+
+        my_service = MyService()
+        my_service.logger = mock.Mock()
+        summaries = []
+
+        my_service.on('error_summary', summaries.append)
+        my_service.start()
+
+        for _ in range(5):
+            my_service.spawn(lambda: 1 / 0)
+
+        gevent.sleep(0.01)
+
+        self.assertEqual(my_service.logger.error.call_count, 1)
+
+        my_service.stop()
+
+        self.assertEqual(my_service.logger.error.call_count, 2)
+        self.assertEqual(summaries[0][0]['suppressed'], 4)
+
+    def test_run_in_thread(self):
+        """
+        `run_in_thread` must call the function in a native thread without
+        blocking the hub.
+        """
+        import threading
+
+        class MyService(service.Service):
+            threadpool_size = 2
+
+        my_service = MyService()
+        main_thread = threading.current_thread().ident
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0.01)
+
+        def blocking():
+            time.sleep(0.1)
+
+            return threading.current_thread().ident
+
+        ticker = gevent.spawn(tick)
+
+        try:
+            thread_ident = my_service.run_in_thread(blocking)
+        finally:
+            ticker.kill()
+
+        self.assertNotEqual(thread_ident, main_thread)
+        self.assertTrue(len(ticks) > 2)
+
+        stats = my_service.threadpool_stats()
+
+        self.assertEqual(stats['maxsize'], 2)
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['active'], 0)
+
+    def test_run_in_thread_error(self):
+        """
+        An exception raised in the thread must be raised in the greenlet.
+        """
+        my_service = make_service()
+
+        def blow_up():
+            raise RuntimeError('foobar')
+
+        with self.assertRaises(RuntimeError):
+            my_service.run_in_thread(blow_up)
+
+    def test_spawn_blocking_error(self):
+        """
+        An exception raised by a function passed to `spawn_blocking` must be
+        emitted as an error event.
+        """
+        my_service = make_service()
+        errors = []
+
+        def blow_up():
+            raise RuntimeError('foobar')
+
+        my_service.on('error', lambda *exc_info: errors.append(exc_info))
+
+        my_service.spawn_blocking(blow_up).join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0][1], RuntimeError)
+
+    def test_threadpool_lifecycle(self):
+        """
+        A dedicated threadpool must be killed when the service stops.
+        """
+        class MyService(SimpleService):
+            threadpool_size = 1
+
+        my_service = MyService()
+
+        my_service.start()
+
+        threads = my_service.get_threadpool()
+
+        self.assertIs(my_service.get_threadpool(), threads)
+        self.assertEqual(my_service.run_in_thread(lambda: 'foo'), 'foo')
+
+        my_service.stop()
+
+        self.assertIsNot(my_service.get_threadpool(), threads)
+        self.assertEqual(threads.size, 0)
+
+    def test_spawn_process(self):
+        """
+        `spawn_process` must call the function in a worker process and emit
+        any exception as an error event.
+        """
+        import os
+
+        class MyService(SimpleService):
+            process_pool_size = 1
+
+        my_service = MyService()
+        errors = []
+
+        my_service.on('error', lambda *exc_info: errors.append(exc_info))
+
+        my_service.start()
+
+        thread = my_service.spawn_process(os.getpid)
+
+        self.assertNotEqual(thread.get(), os.getpid())
+
+        my_service.spawn_process(int, 'foobar').join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0][1], ValueError)
+
+        process_pool = my_service.get_process_pool()
+
+        my_service.stop()
+
+        self.assertTrue(process_pool.closed)
+        self.assertEqual(process_pool.workers, [])
+
     @mock.patch.object(service.Service, 'spawn')
     def test_add_service(self, mock_spawn):
         """
@@ -380,6 +670,23 @@ class ServiceTestCase(unittest.TestCase):
 
         self.assertTrue(self.executed)
 
+    def test_child_does_not_keep_parent(self):
+        """
+        A child service must not keep its parent alive.
+        """
+        child = make_service()
+        parent = make_service()
+
+        parent.add_service(child)
+
+        parent_ref = weakref.ref(parent)
+
+        del parent
+        gc.collect()
+
+        self.assertIsNone(parent_ref())
+        self.assertEqual(child.listeners('error'), [])
+
     @mock.patch.object(service.Service, 'watch_service')
     def test_add_service_start(self, mock_watch):
         """
@@ -398,6 +705,741 @@ class ServiceTestCase(unittest.TestCase):
         mock_watch.assert_called_once_with(mock_service)
         self.assertEqual(my_service.services, [mock_service])
 
+    def test_stats(self):
+        """
+        `stats` must report the metrics of the service and its children.
+        """
+        parent = make_service(logger=mock.Mock())
+        child = SimpleService()
+
+        parent.add_service(child)
+        parent.on('error', lambda *exc_info: None)
+        parent.start()
+
+        child.spawn(gevent.sleep, 1)
+        parent.spawn(lambda: 1 / 0)
+        gevent.sleep(0.01)
+
+        stats = parent.stats()
+
+        self.assertEqual(stats['service'], 'Service')
+        self.assertTrue(stats['started'])
+        self.assertEqual(stats['children'], 1)
+        self.assertEqual(stats['live'], 0)
+        self.assertEqual(stats['spawned'], 1)
+        self.assertEqual(stats['errors'], 1)
+        self.assertTrue(stats['spawn_rate'] > 0)
+        self.assertIsNotNone(stats['start_duration'])
+        self.assertIsNone(stats['stop_duration'])
+
+        child_stats, = stats['services']
+
+        self.assertEqual(child_stats['live'], 2)
+        self.assertEqual(child_stats['spawned'], 2)
+
+        self.assertEqual(stats['total']['live'], 2)
+        self.assertEqual(stats['total']['spawned'], 3)
+        self.assertEqual(stats['total']['children'], 1)
+
+        parent.stop()
+
+        self.assertIsNotNone(parent.stats()['stop_duration'])
+
+    def test_emit_async(self):
+        """
+        Exceptions raised by listeners of events queued by `emit_async` must be
+        handled by the service and the queue must be in the stats.
+        """
+        logger = mock.Mock()
+        my_service = make_service(logger=logger)
+
+        self.assertIsNone(my_service.stats()['dispatcher'])
+
+        my_service.on('foo', lambda: 1 / 0)
+        my_service.emit_async('foo')
+        my_service.flush_events()
+
+        self.assertTrue(logger.error.called)
+
+        stats = my_service.stats()
+
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['dispatcher']['dispatched'], 1)
+
+    def test_task_group(self):
+        """
+        A task group must wait for its greenlets and gather their results in
+        the order they were spawned.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        def work(i):
+            gevent.sleep(0.01 * (3 - i))
+
+            return i
+
+        with my_service.task_group() as group:
+            for i in range(3):
+                group.spawn(work, i)
+
+        self.assertEqual(group.results, [0, 1, 2])
+        self.assertEqual(len(my_service.pool), 0)
+
+        with self.assertRaises(RuntimeError):
+            group.spawn(work, 4)
+
+    def test_task_group_error(self):
+        """
+        The first exception must cancel the other greenlets and be raised
+        when the block exits.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        def fail():
+            gevent.sleep(0.01)
+
+            raise ValueError('foo')
+
+        start = time.time()
+
+        with self.assertRaises(ValueError):
+            with my_service.task_group() as group:
+                slow = group.spawn(gevent.sleep, 10)
+                group.spawn(fail)
+
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(slow.dead)
+        self.assertIsNone(group.results)
+        self.assertEqual(len(my_service.pool), 0)
+        self.assertFalse(my_service.logger.error.called)
+
+    def test_task_group_timeout(self):
+        """
+        Greenlets that do not complete before the deadline must be killed.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        with self.assertRaises(service.TaskGroupTimeout):
+            with my_service.task_group(timeout=0.05) as group:
+                fast = group.spawn(lambda: 1)
+                slow = group.spawn(gevent.sleep, 10)
+
+        self.assertEqual(fast.value, 1)
+        self.assertTrue(slow.dead)
+        self.assertEqual(len(my_service.pool), 0)
+
+    def test_task_group_body_error(self):
+        """
+        An exception raised in the block must kill the greenlets.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        with self.assertRaises(KeyError):
+            with my_service.task_group() as group:
+                slow = group.spawn(gevent.sleep, 10)
+
+                raise KeyError
+
+        self.assertTrue(slow.dead)
+
+    def test_imap_unordered(self):
+        """
+        `imap_unordered` must yield results as they complete, with at most
+        ``concurrency`` greenlets in flight and consume the items lazily.
+        """
+        my_service = make_service(logger=mock.Mock())
+        consumed = []
+        in_flight = []
+
+        def items():
+            for i in range(10):
+                consumed.append(i)
+
+                yield i
+
+        def work(i):
+            in_flight.append(len(my_service.pool))
+            gevent.sleep(0.01 * (i % 3))
+
+            return i * 2
+
+        results = my_service.imap_unordered(work, items(), concurrency=3)
+
+        self.assertEqual(consumed, [])
+
+        first = next(results)
+
+        self.assertEqual(first, 0)
+        self.assertTrue(len(consumed) <= 4)
+
+        self.assertEqual(
+            sorted([first] + list(results)), [i * 2 for i in range(10)]
+        )
+        self.assertEqual(max(in_flight), 3)
+
+    def test_imap(self):
+        """
+        `imap` and `map` must return the results in order.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        def work(i):
+            gevent.sleep(0.01 * (3 - i % 3))
+
+            return i
+
+        self.assertEqual(
+            list(my_service.imap(work, range(10), concurrency=3)), range(10)
+        )
+        self.assertEqual(my_service.map(work, range(10)), range(10))
+
+    def test_map_error(self):
+        """
+        An exception raised by the function must be raised by the iterator
+        and the remaining greenlets must be killed.
+        """
+        my_service = make_service(logger=mock.Mock())
+
+        def work(i):
+            if i == 1:
+                raise ValueError(i)
+
+            gevent.sleep(1)
+
+        with self.assertRaises(ValueError):
+            my_service.map(work, range(5), concurrency=3)
+
+        gevent.sleep(0)
+
+        self.assertEqual(len(my_service.pool), 0)
+        self.assertFalse(my_service.logger.error.called)
+
+    def test_map_stop(self):
+        """
+        Stopping the service must raise `ServiceStopping` in the iterator.
+        """
+        my_service = SimpleService()
+
+        my_service.start()
+
+        gevent.spawn_later(0.01, my_service.stop)
+
+        with self.assertRaises(service.ServiceStopping):
+            my_service.map(gevent.sleep, [1] * 5)
+
+    def test_watch_children_without_greenlets(self):
+        """
+        Watching child services must not use a greenlet per child and the
+        parent must stop when a child stops.
+        """
+        parent = make_service(logger=mock.Mock())
+        children = [SimpleService() for _ in range(10)]
+
+        parent.add_service(*children)
+        parent.start()
+
+        self.assertEqual(len(parent.pool), 0)
+
+        children[3].stop()
+        gevent.sleep(0.01)
+
+        self.assertFalse(parent.started)
+
+        for child in children:
+            self.assertFalse(child.started)
+
+    def test_add_service_depends_on(self):
+        """
+        Dependencies must already be added to the parent service.
+        """
+        my_service = make_service()
+        first = mock.Mock()
+        second = mock.Mock()
+
+        with self.assertRaises(ValueError):
+            my_service.add_service(second, depends_on=[first])
+
+        with self.assertRaises(TypeError):
+            my_service.add_service(first, foo='bar')
+
+        my_service.add_service(first)
+        my_service.add_service(second, depends_on=[first])
+
+        self.assertEqual(my_service.services, [first, second])
+
+    def test_start_children_concurrently(self):
+        """
+        Independent child services must be started concurrently and a child
+        must only be started once its dependencies have started.
+        """
+        self.started = []
+
+        class ChildService(SimpleService):
+            def __init__(self, name):
+                super(ChildService, self).__init__()
+
+                self.name = name
+
+            def do_start(self):
+                gevent.sleep(0.1)
+
+                started.append(self.name)
+
+                super(ChildService, self).do_start()
+
+        started = self.started
+        parent = make_service()
+        db = ChildService('db')
+        cache = ChildService('cache')
+        web = ChildService('web')
+
+        parent.add_service(db, cache)
+        parent.add_service(web, depends_on=[db, cache])
+
+        start = time.time()
+
+        parent.start()
+
+        # the critical path is two children deep
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertEqual(sorted(started[:2]), ['cache', 'db'])
+        self.assertEqual(started[2], 'web')
+        self.assertTrue(web.started)
+
+        parent.stop()
+
+    def test_start_children_error(self):
+        """
+        If a child service fails to start, the exception must be raised by the
+        parent and dependent services must not be started.
+        """
+        class BrokenService(service.Service):
+            def do_start(self):
+                raise RuntimeError('foobar')
+
+        parent = make_service(logger=mock.Mock())
+        broken = BrokenService()
+        broken.logger = mock.Mock()
+        dependent = mock.Mock()
+
+        parent.add_service(broken)
+        parent.add_service(dependent, depends_on=[broken])
+
+        with self.assertRaises(RuntimeError):
+            parent.start()
+
+        self.assertFalse(dependent.start.called)
+        self.assertFalse(parent.started)
+
+    def test_start_children_sequentially(self):
+        """
+        Setting `concurrent_start` to `False` must start the children in the
+        order that they were added.
+        """
+        class MyService(service.Service):
+            concurrent_start = False
+
+        parent = MyService()
+        children = mock.Mock()
+
+        parent.add_service(children.first, children.second)
+        parent.start_children()
+
+        calls = [
+            call for call in children.mock_calls if call[0].endswith('start')
+        ]
+
+        self.assertEqual(calls, [
+            mock.call.first.start(block=True),
+            mock.call.second.start(block=True),
+        ])
+
+    def test_stop_children_concurrently(self):
+        """
+        Child services must be stopped concurrently and a child must only be
+        stopped once the services that depend on it have stopped.
+        """
+        stopped = []
+
+        class ChildService(SimpleService):
+            def __init__(self, name):
+                super(ChildService, self).__init__()
+
+                self.name = name
+
+            def do_teardown(self):
+                gevent.sleep(0.1)
+
+                stopped.append(self.name)
+
+        parent = make_service()
+        db = ChildService('db')
+        cache = ChildService('cache')
+        web = ChildService('web')
+
+        parent.add_service(db, cache)
+        parent.add_service(web, depends_on=[db, cache])
+
+        parent.start()
+
+        start = time.time()
+
+        parent.stop()
+
+        # the critical path is two children deep
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertEqual(stopped[0], 'web')
+        self.assertEqual(sorted(stopped[1:]), ['cache', 'db'])
+        self.assertFalse(db.started)
+        self.assertFalse(web.started)
+
+    def test_stop_timeout(self):
+        """
+        Child services that do not stop before `stop_timeout` must be killed.
+        """
+        class SlowService(SimpleService):
+            def do_teardown(self):
+                gevent.sleep(10)
+
+        class MyService(service.Service):
+            stop_timeout = 0.05
+
+        parent = MyService()
+        parent.logger = mock.Mock()
+        child = SlowService()
+
+        parent.add_service(child)
+        parent.start()
+
+        start = time.time()
+
+        parent.stop()
+
+        self.assertTrue(time.time() - start < 1)
+        self.assertFalse(parent.started)
+        self.assertTrue(parent.logger.warning.called)
+
+        # give the killed child a chance to clean up
+        gevent.sleep(0.01)
+
+        self.assertIsNone(child._run_thread)
+
+    def test_stop_timeout_dependencies(self):
+        """
+        Child services that have not started stopping when `stop_timeout`
+        expires (because they are waiting for their dependents) must be
+        killed without a graceful teardown and the parent must wait for them.
+        """
+        class SlowService(SimpleService):
+            tore_down = False
+
+            def do_teardown(self):
+                gevent.sleep(10)
+
+                self.tore_down = True
+
+        class MyService(service.Service):
+            stop_timeout = 0.1
+
+        parent = MyService()
+        parent.logger = mock.Mock()
+        a = SlowService()
+        b = SimpleService()
+        c = SlowService()
+
+        parent.add_service(a, b)
+        parent.add_service(c, depends_on=[a])
+        parent.start()
+
+        start = time.time()
+
+        parent.stop()
+
+        self.assertTrue(time.time() - start < 1)
+
+        for child in (a, b, c):
+            self.assertFalse(child.is_running())
+
+        self.assertFalse(a.tore_down)
+        self.assertFalse(c.tore_down)
+
+    def test_drain(self):
+        """
+        When `drain_timeout` is set, running greenlets must be allowed to
+        finish when the service is stopped.
+        """
+        class MyService(SimpleService):
+            drain_timeout = 0.2
+
+        my_service = MyService()
+        my_service.logger = mock.Mock()
+        self.finished = False
+        self.drained = None
+
+        def work():
+            gevent.sleep(0.05)
+
+            self.finished = True
+
+        @my_service.on('drain')
+        def on_drain(drained, killed):
+            self.drained = (drained, killed)
+
+        my_service.start()
+        my_service.spawn(work)
+        my_service.stop()
+
+        self.assertTrue(self.finished)
+        # the `SimpleService.sleep` greenlet never finishes
+        self.assertEqual(self.drained, (1, 1))
+
+    def test_teardown_spawn(self):
+        """
+        Spawning from `do_teardown` must work when the service does not drain
+        its greenlets.
+        """
+        class MyService(service.Service):
+            def do_teardown(self):
+                self.spawned = self.spawn(gevent.sleep, 0)
+
+        my_service = MyService()
+        my_service.logger = mock.Mock()
+        my_service.on('error', mock.Mock())
+
+        my_service.start()
+        my_service.stop()
+
+        self.assertIsInstance(my_service.spawned, service.ServiceGreenlet)
+
+    def test_drain_spawn(self):
+        """
+        Spawning while the service is draining must raise `ServiceStopping`.
+        """
+        class MyService(service.Service):
+            drain_timeout = 0.2
+
+        my_service = MyService()
+        my_service.logger = mock.Mock()
+        self.raised = False
+
+        def work():
+            gevent.sleep(0.01)
+
+            try:
+                my_service.spawn(work)
+            except service.ServiceStopping:
+                self.raised = True
+
+        my_service.spawn(gevent.sleep, 10)
+        my_service.start()
+        my_service.spawn(work)
+        my_service.stop()
+
+        self.assertTrue(self.raised)
+
+        # the service accepts greenlets again once it is stopped
+        my_service.spawn(gevent.sleep, 0).join()
+
+    def test_restart_permanent(self):
+        """
+        A child service with a permanent restart policy must be restarted
+        until it has been restarted too many times.
+        """
+        from biloba import supervisor
+
+        class ChildService(service.Service):
+            def do_start(self):
+                self.spawn(gevent.sleep, 0.01)
+
+        parent = make_service(logger=mock.Mock())
+        child = ChildService()
+        restarts = []
+
+        parent.on('restart', restarts.append)
+        parent.add_service(child, restart=supervisor.RestartPolicy(
+            max_restarts=3, backoff=0.001
+        ))
+
+        with gevent.Timeout(1):
+            parent.join()
+
+        self.assertEqual(restarts, [child] * 3)
+        self.assertTrue(parent.logger.error.called)
+
+    def test_restart_bounded_pool(self):
+        """
+        A child must be restarted even if the pool of the parent is full.
+        """
+        class ChildService(service.Service):
+            starts = 0
+
+            def do_start(self):
+                self.starts += 1
+                self.spawn(gevent.sleep, 0.01)
+
+        class ParentService(service.Service):
+            pool_size = 1
+            pool_policy = 'fail'
+
+        parent = ParentService()
+        parent.logger = mock.Mock()
+        child = ChildService()
+
+        parent.add_service(child, restart='permanent')
+        parent.start()
+        parent.spawn(gevent.sleep, 10)
+
+        gevent.sleep(0.1)
+
+        self.assertTrue(child.starts > 1)
+        self.assertTrue(parent.started)
+
+        parent.stop()
+
+        self.assertEqual(parent._restarts, set())
+
+    def test_restart_empty_pool(self):
+        """
+        The parent must not stop because its pool emptied while a child is
+        waiting to be restarted.
+        """
+        from biloba import supervisor
+
+        class ChildService(service.Service):
+            starts = 0
+
+            def do_start(self):
+                self.starts += 1
+
+                if self.starts == 1:
+                    self.spawn(gevent.sleep, 0.01)
+                else:
+                    self.spawn(gevent.sleep, 10)
+
+        parent = make_service(logger=mock.Mock())
+        child = ChildService()
+        restarts = []
+
+        parent.on('restart', restarts.append)
+        parent.add_service(child, restart=supervisor.RestartPolicy(
+            backoff=0.2
+        ))
+        parent.start()
+        parent.spawn(gevent.sleep, 0.05)
+
+        gevent.sleep(0.4)
+
+        self.assertEqual(restarts, [child])
+        self.assertTrue(parent.started)
+        self.assertTrue(child.started)
+
+        parent.stop()
+
+    def test_restart_keeps_siblings(self):
+        """
+        Restarting a child must not affect the other children.
+        """
+        class FlakyService(service.Service):
+            starts = 0
+
+            def do_start(self):
+                self.starts += 1
+                self.spawn(gevent.sleep, 0.01)
+
+        parent = make_service(logger=mock.Mock())
+        flaky = FlakyService()
+        sibling = SimpleService()
+
+        parent.add_service(flaky, restart='permanent')
+        parent.add_service(sibling)
+
+        parent.start()
+        gevent.sleep(0.1)
+
+        self.assertTrue(flaky.starts > 1)
+        self.assertTrue(parent.started)
+        self.assertTrue(sibling.started)
+
+        parent.stop()
+
+    def test_restart_transient(self):
+        """
+        A transient child must only be restarted if it failed.
+        """
+        class ChildService(service.Service):
+            starts = 0
+
+            def do_start(self):
+                self.starts += 1
+                self.spawn(self.work, self.starts)
+
+            def work(self, starts):
+                gevent.sleep(0.01)
+
+                if starts == 1:
+                    raise RuntimeError('foobar')
+
+        parent = SimpleService()
+        parent.logger = mock.Mock()
+        child = ChildService()
+        errors = []
+
+        parent.on('error', lambda *exc_info: errors.append(exc_info))
+        parent.add_service(child, restart='transient')
+
+        parent.start()
+        gevent.sleep(0.1)
+
+        # the first run failed so the child was restarted. the second run
+        # exited cleanly so it is not restarted and the parent keeps running
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(child.starts, 2)
+        self.assertFalse(child.started)
+        self.assertTrue(parent.started)
+
+        parent.stop()
+
+    def test_restart_temporary(self):
+        """
+        A temporary child that exits must not stop the parent.
+        """
+        parent = SimpleService()
+        child = make_service()
+
+        parent.add_service(child, restart='temporary')
+
+        parent.start()
+        gevent.sleep(0.01)
+
+        self.assertFalse(child.started)
+        self.assertTrue(parent.started)
+
+        parent.stop()
+
+    def test_restart_temporary_pruned(self):
+        """
+        Children that exit and will not be restarted must be forgotten.
+        """
+        parent = SimpleService()
+        parent.start()
+
+        children = [make_service() for _ in range(10)]
+
+        for child in children:
+            parent.add_service(child, restart='temporary')
+
+        gevent.sleep(0.01)
+
+        self.assertTrue(parent.started)
+        self.assertEqual(parent.services, [])
+        self.assertEqual(parent._restart_policies, {})
+        self.assertEqual(parent._error_subscriptions, {})
+
+        for child in children:
+            self.assertEqual(child.listeners('error'), [])
+
+        parent.stop()
+
     def test_teardown(self):
         """
         Teardown must be called before the state of the service is torn down.
@@ -722,3 +1764,35 @@ class ConfigurableServiceTestCase(unittest.TestCase):
         svc = service.ConfigurableService(cfg)
 
         self.assertIs(svc.config, cfg)
+
+    def test_pool_options(self):
+        """
+        The pool options must be able to be supplied by config.
+        """
+        from biloba import pool
+
+        svc = service.ConfigurableService({
+            'service_options': {
+                'pool_size': 2,
+                'pool_policy': 'queue',
+                'pool_backlog': 10,
+            },
+        })
+
+        self.assertIsInstance(svc.pool, pool.BoundedPool)
+        self.assertEqual(svc.pool.size, 2)
+        self.assertEqual(svc.pool.policy, pool.QUEUE)
+        self.assertEqual(svc.pool.max_backlog, 10)
+
+    def test_options_key(self):
+        """
+        Config keys outside of ``options_key`` must not change the options.
+        """
+        svc = service.ConfigurableService({
+            'pool_size': 2,
+            'rate_limit': 1,
+        })
+
+        self.assertIsNone(svc.get_option('pool_size'))
+        self.assertIsNone(svc.rate_limiter)
+        self.assertIsNone(svc.stats()['limit'])
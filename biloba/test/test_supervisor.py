@@ -0,0 +1,81 @@
+"""
+Tests for `biloba.supervisor`.
+"""
+
+import unittest
+
+from biloba import supervisor
+
+
+class RestartPolicyTestCase(unittest.TestCase):
+    """
+    Tests for `supervisor.RestartPolicy`.
+    """
+
+    def test_invalid(self):
+        """
+        An unknown restart type must raise `ValueError`.
+        """
+        with self.assertRaises(ValueError):
+            supervisor.RestartPolicy('foobar')
+
+    def test_should_restart(self):
+        """
+        Each restart type must decide whether to restart the child.
+        """
+        permanent = supervisor.RestartPolicy(supervisor.PERMANENT)
+        transient = supervisor.RestartPolicy(supervisor.TRANSIENT)
+        temporary = supervisor.RestartPolicy(supervisor.TEMPORARY)
+
+        self.assertTrue(permanent.should_restart())
+        self.assertFalse(transient.should_restart())
+        self.assertFalse(temporary.should_restart())
+
+        for policy in (permanent, transient, temporary):
+            policy.failed = True
+
+        self.assertTrue(permanent.should_restart())
+        self.assertTrue(transient.should_restart())
+        self.assertFalse(temporary.should_restart())
+
+    def test_backoff(self):
+        """
+        The delay must double for each restart in the window, up to the
+        maximum.
+        """
+        policy = supervisor.RestartPolicy(
+            max_restarts=10, window=10, backoff=1, max_backoff=5
+        )
+
+        delays = [policy.next_delay(now=0) for _ in range(5)]
+
+        self.assertEqual(delays, [1, 2, 4, 5, 5])
+
+    def test_max_restarts(self):
+        """
+        Too many restarts in the window must return `None`, restarts outside
+        the window are forgotten.
+        """
+        policy = supervisor.RestartPolicy(max_restarts=2, window=10)
+
+        self.assertIsNotNone(policy.next_delay(now=0))
+        self.assertIsNotNone(policy.next_delay(now=1))
+        self.assertIsNone(policy.next_delay(now=2))
+
+        self.assertEqual(policy.next_delay(now=10.5), policy.backoff * 2)
+
+    def test_make_policy(self):
+        """
+        `make_policy` must accept a restart type or copy a policy.
+        """
+        policy = supervisor.make_policy(supervisor.TRANSIENT)
+
+        self.assertEqual(policy.restart, supervisor.TRANSIENT)
+
+        policy.failed = True
+
+        other = supervisor.make_policy(policy)
+
+        self.assertIsNot(other, policy)
+        self.assertEqual(other.restart, supervisor.TRANSIENT)
+        self.assertFalse(other.failed)
@@ -0,0 +1,132 @@
+"""
+Tests for `biloba.workers`.
+"""
+
+import unittest
+
+import mock
+import gevent
+
+from biloba import service, workers
+
+
+class MyWorkerPool(workers.WorkerPoolService):
+    worker_count = 2
+    queue_size = 4
+
+
+class WorkerPoolServiceTestCase(unittest.TestCase):
+    """
+    Tests for `workers.WorkerPoolService`.
+    """
+
+    def setUp(self):
+        self.service = MyWorkerPool(logger=mock.Mock())
+        self.service.start()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def test_submit(self):
+        """
+        Submitted tasks must be called by the workers.
+        """
+        results = [
+            self.service.submit(lambda a, b: a * b, i, b=2) for i in range(4)
+        ]
+
+        self.assertEqual([result.get() for result in results], [0, 2, 4, 6])
+        self.assertEqual(len(self.service.workers), 2)
+
+        stats = self.service.stats()
+
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['submitted'], 4)
+        self.assertEqual(stats['completed'], 4)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['live'], 2)
+
+    def test_error(self):
+        """
+        An exception raised by a task must be raised by its result and not
+        affect the worker.
+        """
+        result = self.service.submit(lambda: 1 / 0)
+
+        with self.assertRaises(ZeroDivisionError):
+            result.get()
+
+        self.assertEqual(self.service.submit(lambda: 1).get(), 1)
+        self.assertEqual(len(self.service.workers), 2)
+
+    def test_bounded_queue(self):
+        """
+        `submit` must block while the queue is full.
+        """
+        event = gevent.event.Event()
+
+        for _ in range(6):
+            self.service.submit(event.wait)
+
+        gevent.sleep(0)
+
+        self.assertEqual(self.service.queue.qsize(), 4)
+
+        submitter = gevent.spawn(self.service.submit, event.wait)
+        gevent.sleep(0.01)
+
+        self.assertFalse(submitter.ready())
+
+        event.set()
+        submitter.join()
+
+        self.assertTrue(self.service.stats()['max_wait'] > 0)
+
+    def test_resize(self):
+        """
+        Shrinking must kill idle workers first and let busy workers finish
+        their task.
+        """
+        event = gevent.event.Event()
+
+        busy = self.service.submit(event.wait)
+
+        self.service.resize(4)
+        gevent.sleep(0)
+
+        self.assertEqual(len(self.service.workers), 4)
+
+        self.service.resize(1)
+        gevent.sleep(0)
+
+        # the busy worker is retiring
+        self.assertEqual(len(self.service.workers), 1)
+
+        event.set()
+
+        self.assertTrue(busy.get())
+        self.assertEqual(self.service.submit(lambda: 1).get(), 1)
+        self.assertEqual(len(self.service.workers), 1)
+
+        self.service.resize(0)
+        gevent.sleep(0)
+
+        self.assertEqual(len(self.service.workers), 0)
+
+    def test_stop(self):
+        """
+        Pending and running tasks must fail when the service is stopped.
+        """
+        event = gevent.event.Event()
+
+        results = [self.service.submit(event.wait) for _ in range(3)]
+
+        gevent.sleep(0)
+
+        self.service.stop()
+
+        for result in results:
+            with self.assertRaises(service.ServiceStopping):
+                result.get()
+
+        self.assertEqual(self.service.workers, set())
@@ -0,0 +1,211 @@
+"""
+A service that runs submitted tasks on a fixed set of long lived greenlets.
+"""
+
+import sys
+import time
+
+import gevent
+from gevent import event, queue
+
+from biloba import service
+
+
+__all__ = [
+    'WorkerPoolService',
+]
+
+
+class WorkerPoolService(service.Service):
+    """
+    Keeps ``worker_count`` worker greenlets that call the tasks submitted via
+    `submit` in the order they were submitted. This avoids spawning a new
+    greenlet per task when the task rate is very high.
+
+    Tasks are queued in a queue of at most ``queue_size`` tasks, `submit`
+    blocks while the queue is full. When the service is stopped, queued tasks
+    (and tasks that are running when the workers are killed) fail with
+    `biloba.service.ServiceStopping`. Running tasks are given
+    ``drain_timeout`` seconds to complete.
+
+    :ivar size: The number of workers.
+    :ivar workers: The set of running worker greenlets.
+    :ivar queue: The queue of pending tasks.
+    """
+
+    __slots__ = (
+        'size',
+        'workers',
+        'queue',
+        'submitted',
+        'completed',
+        'wait_time',
+        'max_wait',
+        '_idle',
+        '_retire',
+    )
+
+    # the number of worker greenlets
+    worker_count = 10
+    # the maximum number of pending tasks, `None` means unbounded.
+    queue_size = None
+
+    def __init__(self, logger=None):
+        super(WorkerPoolService, self).__init__(logger=logger)
+
+        self.size = self.get_option('worker_count')
+        self.workers = set()
+        self.queue = queue.Queue(self.get_option('queue_size'))
+        self.submitted = 0
+        self.completed = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+        self._idle = set()
+        self._retire = 0
+
+    def do_start(self):
+        self._retire = 0
+
+        self.spawn_workers()
+
+    def do_teardown(self):
+        # running tasks are allowed to finish (see `drain_timeout`), idle
+        # workers are not needed any more
+        self._retire = len(self.workers) - len(self._idle)
+
+        gevent.killall(list(self._idle))
+
+        self.fail_pending()
+
+    def do_stop(self):
+        # tasks submitted while the service was stopping
+        self.fail_pending()
+
+    def spawn_workers(self):
+        while len(self.workers) < self.size:
+            self.workers.add(self.spawn(self.work))
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue ``func(*args, **kwargs)`` to be called by a worker, blocking
+        while the queue is full.
+
+        :returns: A `gevent.event.AsyncResult` that will hold the result.
+        :raises biloba.service.ServiceStopping: If this service is stopping.
+        """
+        if self._stopping:
+            raise service.ServiceStopping(
+                'Cannot submit {!r}, {!r} is stopping'.format(func, self)
+            )
+
+        result = event.AsyncResult()
+
+        self.queue.put((func, args, kwargs, result, time.time()))
+        self.submitted += 1
+
+        return result
+
+    def resize(self, size):
+        """
+        Change the number of workers. When shrinking, idle workers are killed
+        first and busy workers exit once their current task is complete.
+        """
+        self.size = size
+
+        if not self.started:
+            return
+
+        excess = len(self.workers) - self._retire - size
+
+        if excess <= 0:
+            self._retire = 0
+
+            self.spawn_workers()
+
+            return
+
+        idle = list(self._idle)[:excess]
+
+        gevent.killall(idle)
+
+        self._retire += excess - len(idle)
+
+    def fail_pending(self):
+        """
+        Fail all queued tasks with `biloba.service.ServiceStopping`.
+        """
+        while True:
+            try:
+                task = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            task[3].set_exception(service.ServiceStopping(
+                '{!r} stopped before {!r} was called'.format(self, task[0])
+            ))
+
+    def work(self):
+        """
+        The main loop of a worker greenlet.
+        """
+        current = gevent.getcurrent()
+
+        try:
+            while not self._retire:
+                self._idle.add(current)
+
+                try:
+                    func, args, kwargs, result, queued = self.queue.get()
+                finally:
+                    self._idle.discard(current)
+
+                wait = time.time() - queued
+
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+
+                try:
+                    value = func(*args, **kwargs)
+                except gevent.GreenletExit:
+                    result.set_exception(service.ServiceStopping(
+                        '{!r} stopped while calling {!r}'.format(self, func)
+                    ))
+
+                    raise
+                except (Exception, BaseException) as exc:
+                    result.set_exception(exc, sys.exc_info())
+                else:
+                    result.set(value)
+
+                self.completed += 1
+
+            self._retire -= 1
+        finally:
+            self.workers.discard(current)
+
+    def stats(self):
+        """
+        The same as `biloba.service.Service.stats` with the addition of:
+
+        - ``workers``: The number of workers.
+        - ``idle``: The number of workers waiting for a task.
+        - ``queued``: The number of pending tasks.
+        - ``submitted``/``completed``: The number of tasks submitted and
+          completed (successfully or not).
+        - ``wait_time``: The average number of seconds a task was queued.
+        - ``max_wait``: The longest a task was queued.
+        """
+        snapshot = super(WorkerPoolService, self).stats()
+
+        snapshot.update({
+            'workers': len(self.workers),
+            'idle': len(self._idle),
+            'queued': self.queue.qsize(),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'wait_time': self.wait_time / max(self.completed, 1),
+            'max_wait': self.max_wait,
+        })
+
+        return snapshot